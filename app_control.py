@@ -11,24 +11,210 @@ Features:
 - Persistence of settings to JSON format
 - Automatic detection and addition of new settings
 - Timestamp tracking of settings modifications
+- Reads served from a versioned in-memory snapshot that is replaced, never edited in place
+- Changes batched over a debounce window and written atomically (temp file then rename)
+- Subscribers notified of changed values so they can take effect while running
+- Settings read from disk on first use, so importing has no side effects
+- Separate settings stores (each with its own json file) for running several tombolas in one process
 
 Usage:
     import from app_control import settings, writesettings
 
+    configure('/data/rig1/settings.json')   optional, use another json file than ./settings.json
+    settings['recording_cadence'] = 5       saved after settings_debounce seconds
+    settings.subscribe(callback)            callback(changes) is called with a dictionary of changed values
+    rig2 = SettingsStore(path='/data/rig2/settings.json')
+
 """
 
+import atexit
 import json
+import os
+import threading
 from datetime import datetime
 
 
-VERSION = '2.0.2'
+VERSION = '3.11.0'
+UNSAVED = object()
+
+
+class SettingsStore:
+    """
+    SettingsStore
+
+    The application settings. Reads come from an in-memory snapshot dictionary which each change replaces
+    with a new copy and version number, so a thread reading settings never sees a half-made update.
+    Changes are saved to the json file after the settings_debounce window so several changes in a row
+    cost one write, and each subscriber is called with the values that changed. Nothing is read from
+    disk until the first setting is used, so importing the application has no side effects and each
+    store (for example one per tombola) can use its own json file. A change made with persist False
+    only lasts while running, the json file keeps the saved value when other changes are written.
+
+    Methods:
+        load: Read the settings from the json file, adding the defaults for any that are missing
+        update: Change several settings at once
+        subscribe: Register a callback(changes) for changed values
+        flush: Write any pending changes to the json file now
+        snapshot: Returns the current settings dictionary (do not modify it)
+    """
+    def __init__(self, values=None, path='settings.json'):
+        self.defaults = dict(values if values is not None else initialise())
+        self.path = path
+        self.values = None
+        self.version = 0
+        self.lock = threading.RLock()
+        self.subscribers = []
+        self.timer = None
+        self.dirty = False
+        self.unsaved = {}
+        atexit.register(self.flush)
+
+    def __current(self):
+        """Returns the settings dictionary, loading it on first use"""
+        values = self.values
+        return values if values is not None else self.load()
+
+    def __getitem__(self, key):
+        return self.__current()[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __contains__(self, key):
+        return key in self.__current()
+
+    def __iter__(self):
+        return iter(self.__current())
+
+    def __len__(self):
+        return len(self.__current())
+
+    def get(self, key, default=None):
+        """Returns a setting or the default if it is not set"""
+        return self.__current().get(key, default)
+
+    def keys(self):
+        """Returns the setting names"""
+        return self.__current().keys()
+
+    def items(self):
+        """Returns the setting names and values"""
+        return self.__current().items()
+
+    def snapshot(self):
+        """Returns the current settings dictionary (do not modify it)"""
+        return self.__current()
+
+    def load(self, path=None):
+        """Read the settings from the json file (or a new path), adding the defaults for any that are missing"""
+        with self.lock:
+            if path is not None:
+                self.path = path
+            fsettings = readsettings(self.path)
+            values = dict(self.defaults)
+            missing = False
+            for item in values:
+                try:
+                    values[item] = fsettings[item]
+                except KeyError:
+                    print(f'settings[{item}] Not found in json file using default')
+                    missing = True
+            previous = self.values
+            self.values = values
+            self.unsaved = {}
+            self.version += 1
+            if missing:
+                self.write()
+            subscribers = list(self.subscribers) if previous is not None else []
+        changed = {key: value for key, value in values.items() if previous is not None and previous.get(key) != value}
+        if changed:
+            for callback in subscribers:
+                callback(changed)
+        return self.values
+
+    def update(self, changes, persist=True):
+        """Change several settings at once, saved after the debounce window unless persist is False, in which case
+        the json file keeps the value it had"""
+        with self.lock:
+            current = self.__current()
+            changed = {key: value for key, value in changes.items() if current.get(key, object()) != value}
+            if not changed:
+                return
+            for key in changed:
+                if not persist and key not in self.unsaved:
+                    self.unsaved[key] = current.get(key, UNSAVED)
+                elif persist:
+                    self.unsaved.pop(key, None)
+            values = dict(current)
+            values.update(changed)
+            self.values = values
+            self.version += 1
+            if persist:
+                self.dirty = True
+                if self.timer is not None:
+                    self.timer.cancel()
+                self.timer = threading.Timer(self.values.get('settings_debounce', 0), self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            callback(changed)
+
+    def subscribe(self, callback):
+        """Register a callback(changes) called with a dictionary of the changed values"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a callback registered with subscribe"""
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def flush(self):
+        """Write any pending changes to the json file now"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.dirty:
+                self.dirty = False
+                self.write()
+
+    def write(self):
+        """Write the settings to the json file atomically, via a temporary file renamed over it, with the saved
+        value of any setting changed with persist False"""
+        with self.lock:
+            values = dict(self.__current())
+            values['LastSave'] = datetime.now().strftime('%d/%m/%y %H:%M:%S')
+            self.values = values
+            self.version += 1
+            values = dict(values, **self.unsaved)
+            for key in [key for key, value in values.items() if value is UNSAVED]:
+                del values[key]
+            settings_dir = os.path.dirname(self.path)
+            if settings_dir and not os.path.exists(settings_dir):
+                os.makedirs(settings_dir)
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w', encoding='UTF-8') as outfile:
+                json.dump(values, outfile, indent=4, sort_keys=True)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temporary, self.path)
 
 
 def writesettings():
-    """Write settings to json file"""
-    settings['LastSave'] = datetime.now().strftime('%d/%m/%y %H:%M:%S')
-    with open('settings.json', 'w', encoding='UTF-8') as outfile:
-        json.dump(settings, outfile, indent=4, sort_keys=True)
+    """Write settings to json file now"""
+    settings.dirty = False
+    settings.write()
+
+
+def configure(path):
+    """Use a different settings json file for the application settings, read the next time a setting is used"""
+    with settings.lock:
+        settings.path = path
+        if settings.values is not None:
+            settings.load()
 
 
 def initialise():
@@ -38,24 +224,87 @@ def initialise():
                  'logappname': 'Tombola-Py',
                  'logfilepath': './logs/tombola-app.log',
                  'loglevel': 'INFO',
+                 'log_queue': True,
+                 'log_queue_size': 10000,
+                 'log_overflow': 'drop_new',
+                 'log_json': False,
+                 'console_via_log_queue': True,
                  'drum_apikey': '<type-it-here>',
                  'drum_controller': 'http://192.168.0.10/api',
                  'drum_controller_timeout': 0.5,
+                 'http_pool_size': 4,
+                 'http_retries': 2,
+                 'http_backoff_factor': 0.05,
+                 'rpm_sample_rate': 10,
+                 'rpm_buffer_size': 36000,
+                 'rpm_log_dir': './logs/rpm',
+                 'rpm_log_format': 'csv',
                  'recording_cadence': 10,
                  'camera_controller1': 'http://192.168.0.20/control',
                  'camera_controller2': 'http://192.168.0.21/control',
+                 'camera_controllers': [],
                  'camera_controller_timeout': 0.5,
+                 'camera_retry_time': 30,
                  'camera_qty': 1,
                  'camera_storage': 'sda1',
                  'camera_format': 'x264',
-                 'sensor_debounce_time': 0.1}
+                 'camera_frame_rate': 250,
+                 'camera_recMode': 'normal',
+                 'camera_maxframes': 0,
+                 'camera_resolution': [1920, 1080],
+                 'camera_bits_per_pixel': 12,
+                 'camera_ram_bytes': 8589934592,
+                 'camera_save_rate': 60,
+                 'camera_window_margin': 0.1,
+                 'camera_status_path': '/p/state',
+                 'camera_save_poll_interval': 0.5,
+                 'camera_save_timeout': 300,
+                 'save_queue_size': 2,
+                 'save_backpressure': 'adapt',
+                 'recording_index_path': './logs/recording_index.db',
+                 'sensor_debounce_time': 0.1,
+                 'settings_debounce': 0.5,
+                 'metrics_port': 9105,
+                 'sequence_log_dir': './logs/sequences',
+                 'drum_poll_rate': 20,
+                 'drum_settle_tolerance': 0.5,
+                 'drum_settle_window': 3.0,
+                 'drum_settle_timeout': 120,
+                 'drum_ramp_rate': 0,
+                 'drum_ramp_step_time': 0.25,
+                 'record_when_stable': False,
+                 'offload_mounts': [],
+                 'offload_dir': './offload',
+                 'offload_manifest': './logs/offload_manifest.json',
+                 'offload_workers': 0,
+                 'offload_command': [],
+                 'offload_poll_interval': 10,
+                 'health_check_interval': 2.0,
+                 'health_probe_timeout': 0.5,
+                 'health_window': 20,
+                 'health_degraded_latency': 0.2,
+                 'health_down_failures': 3,
+                 'health_recover_probes': 2,
+                 'rig_start_delay': 1.0,
+                 'rig_pool_workers': 16,
+                 'recording_trigger': 'cadence',
+                 'sensor_type': 'gpio',
+                 'sensor_pin': 'C0',
+                 'sensor_sample_rate': 500,
+                 'sensor_buffer_size': 100000,
+                 'sensor_trigger_angle': 0.0,
+                 'sensor_rotations_per_segment': 1,
+                 'sensor_trigger_output': '',
+                 'sensor_trigger_pulse': 0.001,
+                 'sensor_log_dir': './logs/sensor',
+                 'sensor_replay_file': ''}
     return isettings
 
 
-def readsettings():
+def readsettings(path='settings.json'):
     """Read the json file"""
     try:
-        with open('settings.json', encoding='UTF-8') as json_file:
+        with open(path, encoding='UTF-8') as json_file:
             jsettings = json.load(json_file)
             return jsettings
     except FileNotFoundError:
@@ -64,19 +313,8 @@ def readsettings():
 
 
 def loadsettings():
-    """Replace the default settings with thsoe from the json files"""
-    global settings
-    settingschanged = 0
-    fsettings = readsettings()
-    for item in settings.keys():
-        try:
-            settings[item] = fsettings[item]
-        except KeyError:
-            print(f'settings[{item}] Not found in json file using default')
-            settingschanged = 1
-    if settingschanged == 1:
-        writesettings()
-
-
-settings = initialise()
-loadsettings()
+    """Replace the default settings with those from the json file"""
+    settings.load()
+
+
+settings = SettingsStore()
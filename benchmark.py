@@ -0,0 +1,109 @@
+"""
+Benchmark Module
+
+Measures the performance of the CameraClass against the localhost camera and drum simulators, so
+regressions can be found on a laptop before a run goes on the rig.
+
+Benchmarks:
+    - call throughput: camera API calls per second over a pooled session and over new connections
+    - switch gap: overlap between the incoming and outgoing cameras for each switch and any failed hand-offs
+    - cadence drift: lateness of each switch against its intended time
+
+Usage:
+    python benchmark.py
+    python benchmark.py --duration 30 --cameras 3 --cadence 0.5 --latency 0.01 --jitter 0.005 --failure-rate 0.01
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+import requests
+from app_control import settings
+from connection_pool import EndpointSession
+from simulator import CameraSimulator, DrumSimulator
+
+
+def summarise(values, scale=1000.0):
+    """Returns min, mean and max of a list of values scaled to milliseconds"""
+    if not values:
+        return 'n/a'
+    return 'min %.2f ms  mean %.2f ms  max %.2f ms' % (min(values) * scale, statistics.mean(values) * scale,
+                                                      max(values) * scale)
+
+
+def benchmark_calls(camera, calls):
+    """Returns the calls per second to a camera over a pooled session and over new connections"""
+    session = EndpointSession('benchmark', camera.url, timeout=5)
+    start = time.perf_counter()
+    for _ in range(calls):
+        session.get('/p/state')
+    pooled = calls / (time.perf_counter() - start)
+    session.close()
+    start = time.perf_counter()
+    for _ in range(calls):
+        requests.get(camera.url + '/p/state', timeout=5, headers={'Connection': 'close'})
+    unpooled = calls / (time.perf_counter() - start)
+    return pooled, unpooled
+
+
+def benchmark_switching(cameras, drum, duration, cadence):
+    """Run the cadence recording against the simulators and return the camera object for its statistics"""
+    from camera_timed import CameraClass  # pylint: disable=import-outside-toplevel
+    settings.update({'camera_controllers': [camera.url for camera in cameras],
+                     'drum_controller': drum.url, 'recording_cadence': cadence, 'console_via_log_queue': False,
+                     'camera_save_poll_interval': min(0.1, cadence / 4),
+                     'recording_index_path': os.path.join(tempfile.mkdtemp(), 'benchmark_index.db')}, persist=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        camera = CameraClass()
+        camera.start_camera_recording()
+        time.sleep(duration)
+        camera.stop_camera_recording()
+    return camera
+
+
+def main():
+    """Run the benchmarks and print a report"""
+    parser = argparse.ArgumentParser(description='Benchmark the UCL-Tombola-app against simulated devices')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of cadence recording')
+    parser.add_argument('--cadence', type=float, default=0.5, help='recording cadence in seconds')
+    parser.add_argument('--cameras', type=int, default=2, help='number of simulated cameras')
+    parser.add_argument('--calls', type=int, default=200, help='number of calls for the throughput test')
+    parser.add_argument('--latency', type=float, default=0.002, help='simulated response latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.001, help='simulated latency jitter (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--save-duration', type=float, default=None, help='simulated file save time (s)')
+    args = parser.parse_args()
+    save_duration = args.save_duration if args.save_duration is not None else args.cadence / 2
+    simulator_settings = {'latency': args.latency, 'jitter': args.jitter, 'failure_rate': args.failure_rate}
+    cameras = [CameraSimulator(save_duration=save_duration, **simulator_settings).start()
+               for _ in range(args.cameras)]
+    drum = DrumSimulator(**simulator_settings).start()
+    try:
+        pooled, unpooled = benchmark_calls(cameras[0], args.calls)
+        camera = benchmark_switching(cameras, drum, args.duration, args.cadence)
+    finally:
+        for simulator in cameras + [drum]:
+            simulator.stop()
+    switches = list(camera.switch_history)
+    overlaps = [switch['overlap'] for switch in switches if switch['overlap'] is not None]
+    failed = [switch for switch in switches if switch['stop_sent'] is None]
+    timing = camera.switch_timing()
+    lateness = [actual - intended for intended, actual in camera.switch_job.timing]
+    print('\nUCL-Tombola-app benchmark (%s cameras, latency %s s, jitter %s s, failure rate %s)'
+          % (args.cameras, args.latency, args.jitter, args.failure_rate))
+    print('Call throughput     pooled %.0f calls/s  new connection %.0f calls/s' % (pooled, unpooled))
+    print('Switches            %s completed, %s failed hand-offs' % (len(overlaps), len(failed)))
+    print('Switch overlap      %s' % summarise(overlaps))
+    print('Cadence lateness    %s over %s switches' % (summarise(lateness), timing['runs']))
+    for metrics in camera.save_metrics():
+        print('Camera %s saves      %s completed, %s failed, backlog %s' % (metrics['camera'], metrics['completed'],
+                                                                            metrics['failed'], metrics['backlog']))
+    print('\n' + camera.metrics_summary())
+
+
+if __name__ == "__main__":
+    main()
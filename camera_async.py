@@ -0,0 +1,313 @@
+"""
+Camera Async Module
+
+An asyncio counterpart of the CameraClass for embedding in event-loop control software.
+
+AsyncCameraClass offers awaitable versions of setup_cameras, start_camera_recording, stop_camera_recording,
+set_drum_rpm and get_drum_rpm. All cameras and the drum share one aiohttp client session with a pool of
+keep-alive connections, the camera cadence runs as an asyncio task on monotonic loop deadlines and the
+file saves are tasks that poll the camera until the save has finished, so many device operations can run
+concurrently on one thread without wrapping the blocking CameraClass in run_in_executor.
+
+The recording plan and setup message, rotation order, retry of a camera that failed to start, hand-off order
+(the outgoing camera is only stopped once the incoming camera has acknowledged startRecording), segment
+records, save state check, request metrics labels and the skipping of cadence deadlines missed by a slow
+switch come from the same functions the CameraClass uses, so the two classes cannot drift apart. The health
+monitor, drum control and save backpressure options of the CameraClass are not part of the asyncio version.
+
+Dependencies:
+    - aiohttp: For the shared asynchronous HTTP client (pip install aiohttp)
+
+Usage:
+    import asyncio
+    from camera_async import AsyncCameraClass
+
+    async def main():
+        async with AsyncCameraClass() as camera:
+            await camera.start_camera_recording()
+            await camera.set_drum_rpm(72)
+            await asyncio.sleep(60)
+            print(await camera.get_drum_rpm())
+            await camera.stop_camera_recording()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from app_control import settings
+from camera_pool import camera_name, camera_urls, next_in_rotation
+from connection_pool import REQUEST_ERRORS, REQUEST_SECONDS, REQUEST_TIMEOUTS, request_labels
+from logmanager import logger, console
+from recording_index import RecordingIndex, close_segment, open_segment
+from save_queue import save_in_progress
+from scheduler import next_deadline
+from setup_planner import plan_warnings, recording_setup, unapplied_settings
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncCameraClass:
+    """
+    AsyncCameraClass
+
+    The asyncio version of the CameraClass, use it as an async context manager or call close() when finished.
+
+    Methods:
+        setup_cameras: Plans and sends the recording settings to all cameras.
+        start_camera_recording: Starts the camera cadence recording task.
+        stop_camera_recording: Stops all cameras and waits for the last file saves.
+        switch_camera: Hands recording over to the next camera.
+        set_drum_rpm: Sets the desired RPM of the drum.
+        get_drum_rpm: Gets the RPM of the drum.
+        close: Closes the shared HTTP client.
+    """
+    def __init__(self, client=None, config=None):
+        if aiohttp is None:
+            raise ImportError('aiohttp is needed for the AsyncCameraClass: pip install aiohttp')
+        self.settings = config if config is not None else settings
+        self.headers = {"Accept": "application/json",
+                        "Content-Type": "application/json",
+                        "api-key": self.settings['drum_apikey']}
+        self.client = client
+        self.own_client = client is None
+        self.camera_urls = dict(enumerate(camera_urls(self.settings), start=1))
+        self.drum_url = self.settings['drum_controller']
+        self.recording_index = RecordingIndex(self.settings['recording_index_path'])
+        self.running = False
+        self.camera_no = None
+        self.cadence_task = None
+        self.save_tasks = {}
+        self.segments = {}
+        self.skip_until = {}
+        self.requested_rpm = None
+        self.setup_plan = None
+        self.skipped = 0
+        self.switch_history = []
+
+    async def __aenter__(self):
+        self.__session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __session(self):
+        """Returns the shared client session, created on first use inside the running event loop"""
+        if self.client is None:
+            connector = aiohttp.TCPConnector(limit=self.settings['http_pool_size'] * (len(self.camera_urls) + 1),
+                                             keepalive_timeout=60)
+            self.client = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self.client
+
+    async def close(self):
+        """Close the shared HTTP client if this object created it"""
+        if self.own_client and self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def __request(self, name, method, base_url, path, timeout, payload=None):
+        """Send a request and return (status code, json body), or (None, None) on a timeout or connection error"""
+        url = base_url + path
+        labels = request_labels(name, path)
+        start = time.perf_counter()
+        try:
+            async with self.__session().request(method, url, json=payload,
+                                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                body = await response.json(content_type=None) if response.content_length != 0 else None
+                if response.status >= 400:
+                    REQUEST_ERRORS.inc(status=response.status, **labels)
+                return response.status, body
+        except asyncio.TimeoutError:
+            REQUEST_TIMEOUTS.inc(**labels)
+            logger.error('AsyncCameraClass: Timeout on %s %s', method, url)
+        except (aiohttp.ClientError, ValueError):
+            REQUEST_ERRORS.inc(status='connection', **labels)
+            logger.error('AsyncCameraClass: Request failed %s %s', method, url)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+        return None, None
+
+    async def __camera(self, camera_id, method, path, payload=None):
+        """Send a request to a camera, returns (status code, json body)"""
+        return await self.__request(camera_name(camera_id), method, self.camera_urls[camera_id], path,
+                                    self.settings['camera_controller_timeout'], payload)
+
+    async def __drum(self, payload):
+        """Send a request to the drum controller, returns (status code, json body)"""
+        return await self.__request('drum', 'POST', self.drum_url, '', self.settings['drum_controller_timeout'],
+                                    payload)
+
+    async def setup_cameras(self):
+        """Plan the recording settings as the CameraClass does, send them to all cameras at the same time and
+        read them back, returns a dictionary of camera id and whether its settings were verified"""
+        plan, data_message = recording_setup(len(self.camera_urls), None, self.settings)
+        for warning in plan_warnings(plan, self.settings['recording_cadence']):
+            console('AsyncCameraClass: %s' % warning)
+            logger.warning('AsyncCameraClass: %s', warning)
+        self.setup_plan = plan
+        results = await asyncio.gather(*(self.__setup_camera(camera_id, data_message)
+                                         for camera_id in self.camera_urls))
+        return dict(zip(self.camera_urls, results))
+
+    async def __setup_camera(self, camera_id, data_message):
+        """Send the recording settings to a camera and read them back to check they were applied"""
+        status, _ = await self.__camera(camera_id, 'POST', '/p', data_message)
+        if status != 200:
+            logger.warning('AsyncCameraClass: Failed to Setup camera %s - check camera status', camera_id)
+            return False
+        status, applied = await self.__camera(camera_id, 'GET', '/p')
+        mismatched = unapplied_settings(data_message, applied if status == 200 else {})
+        if mismatched:
+            logger.warning('AsyncCameraClass: Camera %s did not apply %s', camera_id, ', '.join(mismatched))
+            return False
+        return True
+
+    async def start_camera_recording(self):
+        """Start recording on the first camera and start the cadence task"""
+        console('Starting camera recording')
+        logger.info('AsyncCameraClass: starting camera recording on %s cameras', len(self.camera_urls))
+        self.running = True
+        self.camera_no = None
+        camera_id = self.__next_camera(None)
+        if camera_id is not None and await self.__start_recording(camera_id):
+            self.camera_no = camera_id
+        self.cadence_task = asyncio.get_running_loop().create_task(self.__cadence_loop())
+
+    async def stop_camera_recording(self):
+        """Stop the cadence task and all cameras then wait for the file saves to finish"""
+        self.running = False
+        if self.cadence_task is not None:
+            self.cadence_task.cancel()
+            try:
+                await self.cadence_task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(*(self.__camera(camera_id, 'GET', '/stopRecording') for camera_id in self.camera_urls))
+        if self.camera_no in self.segments:
+            self.__queue_save(self.camera_no)
+        console('Stopped all camera recording')
+        logger.info('AsyncCameraClass: Stopping auto recording')
+        pending = [task for task in self.save_tasks.values() if not task.done()]
+        if pending:
+            await asyncio.wait(pending, timeout=self.settings['camera_save_timeout'])
+
+    async def __cadence_loop(self):
+        """Switch cameras every recording_cadence seconds on monotonic loop deadlines, skipping any deadline that
+        passed while a slow switch was running as the MonotonicScheduler does"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + float(self.settings['recording_cadence'])
+        while self.running:
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            try:
+                await self.switch_camera()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('AsyncCameraClass: Camera switch failed')
+            deadline, missed = next_deadline(deadline, float(self.settings['recording_cadence']), loop.time())
+            if missed:
+                self.skipped += missed
+                logger.warning('AsyncCameraClass: Camera switch skipped %s missed deadlines', missed)
+
+    def __next_camera(self, current):
+        """Returns the next camera in rotation after the current one that is not saving or being skipped"""
+        return next_in_rotation(sorted(self.camera_urls), current, self.__available)
+
+    def __available(self, camera_id):
+        """Returns True if a camera is not saving and not being skipped after failing to respond"""
+        task = self.save_tasks.get(camera_id)
+        return (task is None or task.done()) and time.monotonic() >= self.skip_until.get(camera_id, 0.0)
+
+    async def switch_camera(self):
+        """Hand recording over to the next camera, the outgoing camera is stopped once the incoming one has started"""
+        if not self.running:
+            return
+        outgoing = self.camera_no
+        incoming = self.__next_camera(outgoing)
+        if incoming is None:
+            if len(self.camera_urls) == 1 and outgoing is not None:
+                self.camera_no = None
+                await self.__camera(outgoing, 'GET', '/stopRecording')
+                self.__queue_save(outgoing)
+            else:
+                logger.warning('AsyncCameraClass: No camera free to take over, camera %s keeps recording', outgoing)
+            return
+        handoff = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'outgoing': outgoing,
+                   'incoming': incoming, 'start_sent': None, 'start_ack': None, 'stop_sent': None,
+                   'stop_ack': None, 'overlap': None, 'gap': None}
+        await self.__camera(incoming, 'GET', '/flushRecording')
+        handoff['start_sent'] = time.monotonic()
+        started = await self.__start_recording(incoming)
+        handoff['start_ack'] = time.monotonic()
+        if not started:
+            self.skip_until[incoming] = time.monotonic() + self.settings['camera_retry_time']
+            console('AsyncCameraClass: Camera %s did not start, camera %s left recording' % (incoming, outgoing))
+            self.switch_history.append(handoff)
+            return
+        self.skip_until.pop(incoming, None)
+        self.camera_no = incoming
+        if outgoing is not None:
+            handoff['stop_sent'] = time.monotonic()
+            await self.__camera(outgoing, 'GET', '/stopRecording')
+            handoff['stop_ack'] = time.monotonic()
+            handoff['overlap'] = handoff['stop_sent'] - handoff['start_ack']
+            handoff['gap'] = max(0.0, handoff['start_ack'] - handoff['stop_sent'])
+            self.switch_history.append(handoff)
+            self.__queue_save(outgoing)
+        console('AsyncCameraClass: Switched completed to camera %s' % incoming)
+
+    async def __start_recording(self, camera_id):
+        """Start recording on a camera and note the start of its segment, returns True if it started"""
+        status, _ = await self.__camera(camera_id, 'GET', '/startRecording')
+        if status == 200:
+            self.segments[camera_id] = open_segment(camera_id, self.requested_rpm)
+            return True
+        logger.warning('AsyncCameraClass: Failed to start recording camera %s status = %s', camera_id, status)
+        return False
+
+    def __queue_save(self, camera_id):
+        """Index the segment that has just stopped on a camera and start a task to save it"""
+        segment = close_segment(self.segments.pop(camera_id), self.settings['camera_frame_rate'],
+                                max_frames=self.setup_plan['recMaxFrames'] if self.setup_plan else None)
+        self.recording_index.add_segment(segment)
+        self.save_tasks[camera_id] = asyncio.get_running_loop().create_task(self.__file_save(camera_id,
+                                                                                            segment['filename']))
+
+    async def __file_save(self, camera_id, filename):
+        """Start a file save on a camera and poll the camera state until it has finished"""
+        payload = {'filename': filename, 'device': self.settings['camera_storage'], 'format': self.settings['camera_format']}
+        start = time.monotonic()
+        status, _ = await self.__camera(camera_id, 'POST', '/startFilesave', payload)
+        saved = False
+        if status == 200:
+            while time.monotonic() - start < self.settings['camera_save_timeout']:
+                await asyncio.sleep(self.settings['camera_save_poll_interval'])
+                status, body = await self.__camera(camera_id, 'GET', self.settings['camera_status_path'])
+                if status == 200 and not save_in_progress(body):
+                    saved = True
+                    break
+        self.recording_index.set_save_status(filename, 'completed' if saved else 'failed')
+        logger.info('AsyncCameraClass: Camera %s save %s %s in %.1f s', camera_id, filename,
+                    'completed' if saved else 'failed', time.monotonic() - start)
+        return saved
+
+    async def set_drum_rpm(self, speed: float):
+        """Set the drum RPM, returns the speed set or 0.0 if the request failed"""
+        status, _ = await self.__drum({'setrpm': speed})
+        if status != 200:
+            logger.error('AsyncCameraClass: Drum controller did not accept speed %s, status = %s', speed, status)
+            console('AsyncCameraClass: set_drum_speed request failed, check the raspberry pi')
+            return 0.0
+        self.requested_rpm = speed
+        console('AsyncCameraClass: Drum speed set to %s' % str(speed))
+        return speed
+
+    async def get_drum_rpm(self):
+        """Returns the drum RPM or 0.0 if the request failed"""
+        status, body = await self.__drum({'rpm': True})
+        if status != 200 or not isinstance(body, dict) or 'rpm' not in body:
+            return 0.0
+        return body['rpm']
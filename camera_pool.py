@@ -0,0 +1,138 @@
+"""
+Camera Pool Module
+
+A round-robin pool of N Chronos cameras.
+
+The cameras are configured as a list of controller urls in the camera_controllers setting (if the list
+is empty the older camera_controller1, camera_controller2 and camera_qty settings are used). Each camera
+has its own pooled session and background save queue. The pool picks the next camera to record in
+rotation, skipping any camera that is still saving, has recently failed or that the health monitor
+reports as down, and fans calls out to all cameras concurrently so start-up and shutdown time does
+not grow with the number of cameras.
+
+Settings used:
+    - camera_controllers: list of camera controller urls
+    - camera_retry_time: seconds a camera that failed to respond is skipped before it is tried again
+
+Usage:
+    from camera_pool import CameraPool, camera_urls
+
+    pool = CameraPool(camera_urls(), timeout, headers, start_save, on_complete)
+    camera_id = pool.next_camera(current_camera_id)
+    results = pool.fan_out(stop_recording)
+    camera_id = next_in_rotation([1, 2, 3], 1, usable)     the rotation rule on its own
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app_control import settings
+from connection_pool import EndpointSession
+from logmanager import logger
+from save_queue import FileSaveQueue
+
+
+def camera_urls(config=None):
+    """Returns the list of camera controller urls from the settings"""
+    config = config if config is not None else settings
+    if config['camera_controllers']:
+        return list(config['camera_controllers'])
+    legacy = [config['camera_controller1'], config['camera_controller2']]
+    return legacy[:max(1, config['camera_qty'])]
+
+
+def camera_name(camera_id, name=''):
+    """Returns the endpoint name of a camera, prefixed with the rig name if there is one"""
+    return '%scamera%s' % (name + '-' if name else '', camera_id)
+
+
+def next_in_rotation(ids, current, usable):
+    """Returns the first camera id after current, in rotation order, for which usable(camera_id) is True"""
+    start = ids.index(current) + 1 if current in ids else 0
+    for offset in range(len(ids)):
+        camera_id = ids[(start + offset) % len(ids)]
+        if camera_id != current and usable(camera_id):
+            return camera_id
+    return None
+
+
+class PooledCamera:
+    """A camera in the pool with its session, save queue and health"""
+    def __init__(self, camera_id, url, session, save_queue):
+        self.camera_id = camera_id
+        self.url = url
+        self.session = session
+        self.save_queue = save_queue
+        self.failures = 0
+        self.skip_until = 0.0
+        self.state = 'up'
+
+    def healthy(self):
+        """Returns False while a camera that failed to respond is being skipped or is down"""
+        return self.state != 'down' and time.monotonic() >= self.skip_until
+
+    def available(self):
+        """Returns True if the camera is healthy and not saving"""
+        return self.healthy() and not self.save_queue.busy()
+
+
+class CameraPool:
+    """
+    CameraPool
+
+    A round-robin pool of cameras numbered from 1. Several pools (one per tombola) can share one executor,
+    in which case they are told apart in the metrics and logs by their name.
+
+    Methods:
+        ids: Returns the camera ids in rotation order
+        next_camera: Returns the next camera after the current one that is free to record
+        mark_failed: Skip a camera that did not respond
+        mark_ok: Clear the failures of a camera that responded
+        fan_out: Run a function for each camera concurrently
+    """
+    def __init__(self, urls, timeout, headers, start_save, on_complete=None, config=None, executor=None, name=''):
+        self.settings = config if config is not None else settings
+        self.labels = {'rig': name} if name else {}
+        self.cameras = {}
+        for camera_id, url in enumerate(urls, start=1):
+            session = EndpointSession(camera_name(camera_id, name), url, timeout, headers, self.settings)
+            save_queue = FileSaveQueue(camera_id, session, start_save, on_complete, self.settings, self.labels)
+            self.cameras[camera_id] = PooledCamera(camera_id, url, session, save_queue)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.cameras)), thread_name_prefix='camera-pool')
+        self.executor = executor
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __getitem__(self, camera_id):
+        return self.cameras[camera_id]
+
+    def ids(self):
+        """Returns the camera ids in rotation order"""
+        return sorted(self.cameras)
+
+    def next_camera(self, current, include_busy=False):
+        """Returns the next camera after the current one that is healthy and (unless include_busy) not saving"""
+        return next_in_rotation(self.ids(), current, lambda camera_id: self.cameras[camera_id].available()
+                                or (include_busy and self.cameras[camera_id].healthy()))
+
+    def mark_failed(self, camera_id):
+        """Skip a camera that did not respond for camera_retry_time seconds"""
+        camera = self.cameras[camera_id]
+        camera.failures += 1
+        camera.skip_until = time.monotonic() + self.settings['camera_retry_time']
+        logger.warning('CameraPool: Camera %s skipped for %s seconds after %s failures', camera_id,
+                       self.settings['camera_retry_time'], camera.failures)
+
+    def mark_ok(self, camera_id):
+        """Clear the failures of a camera that responded"""
+        camera = self.cameras[camera_id]
+        camera.failures = 0
+        camera.skip_until = 0.0
+
+    def fan_out(self, function, *args, camera_ids=None):
+        """Run function(camera_id, *args) for each camera concurrently, returns a dictionary of the results.
+        It waits for the pool's workers, so it must not be called from a task running on the same pool."""
+        camera_ids = self.ids() if camera_ids is None else camera_ids
+        futures = {camera_id: self.executor.submit(function, camera_id, *args) for camera_id in camera_ids}
+        return {camera_id: future.result() for camera_id, future in futures.items()}
@@ -2,30 +2,61 @@
 Camera Timed Module
 
 A module for controlling Chronos 2.1(HD) high-speed cameras through their API. Features include:
-- Switching between two cameras based on configurable time cadence
+- Switching round-robin between N cameras based on configurable time cadence
+- Or switching on the rotation of the drum, triggered by the drum position sensor
 - Controlling drum RPM via the UCL Tombola Controller API
 - Recording management (start/stop/save recordings)
 - Camera setup and configuration
 - Settings management through a JSON configuration file
 
 The module implements a CameraClass to handle all camera operations including recording,
-file saving, and drum speed control. It's designed to work with either one or two cameras
-based on configuration settings.
+file saving, and drum speed control. It's designed to work with any number of cameras
+listed in the configuration settings.
 
 Dependencies:
     - requests: For API communication
-    - threading: For timer-based camera switching
-    - datetime: For timestamped filenames
+    - camera_pool: For the round-robin pool of cameras
+    - connection_pool: For keep-alive pooled sessions to the cameras and drum
+    - drum_control: For closed-loop drum speed changes that wait for the speed to settle
+    - drum_sensor: For switching cameras on drum rotation triggers from the position sensor
+    - health_monitor: For background health checks that take a down camera out of the rotation
+    - rpm_sampler: For a continuous drum speed trace held in memory and written to file
+    - save_queue (through camera_pool): For saving files in the background while recording continues
+    - scheduler: For drift-free camera switching on monotonic deadlines
+    - concurrent.futures: For waiting on the outgoing camera stop and save
+    - datetime: For the time of each switch in the switch history
+    - recording_index: For the catalogue of recorded segments
+    - metrics: For latency, error, switch and save metrics served on a local endpoint
+    - setup_planner: For planning the frames recorded in each cadence window
     - app_control: For settings management
     - logmanager: For logging operations
 
 """
 
-import threading
+import time
+from collections import deque
+from concurrent.futures import wait
 from datetime import datetime
 import requests
-from app_control import settings, writesettings
-from logmanager import logger
+from app_control import settings
+from camera_pool import CameraPool, camera_urls
+from connection_pool import EndpointSession
+from drum_control import DrumController
+from drum_sensor import TriggeredSwitch
+from health_monitor import HealthMonitor
+from logmanager import logger, console
+from metrics import registry, start_server
+from recording_index import RecordingIndex, close_segment, open_segment
+from rpm_sampler import RpmSampler
+from scheduler import MonotonicScheduler
+from setup_planner import plan_warnings, recording_setup, unapplied_settings
+
+
+SWITCH_OVERLAP = registry.gauge('tombola_switch_overlap_seconds', 'Overlap of the incoming and outgoing cameras '
+                                'at the last switch')
+SWITCH_LATENESS = registry.gauge('tombola_cadence_lateness_seconds', 'Lateness of the last camera switch against '
+                                 'its intended time')
+SWITCH_COUNT = registry.counter('tombola_switches_total', 'Camera switches by outcome')
 
 
 class CameraClass:
@@ -33,193 +64,420 @@ class CameraClass:
     CameraClass
 
     A class representing a camera sensor/record process.
-    It initializes the CameraClass object by setting the properties such as board id, start and end sensors,
-    running and recording flags, headers, camera url, camera timeout, and drum url and timeout.
-    It also checks if the CONTROLLER is None and logs an error message if it is.
+    Each object uses the application settings unless it is given its own SettingsStore (config), so one
+    process can control several tombolas.
+    It initializes the CameraClass object by setting the properties such as the camera pool, running flag,
+    headers, camera timeout, and drum url and timeout. Recording rotates round-robin through the cameras
+    listed in the settings, skipping any camera that is still saving or not responding. The cameras switch
+    every recording_cadence seconds, or if recording_trigger is sensor on the rotation triggers of the drum
+    position sensor, so each segment covers sensor_rotations_per_segment whole turns of the drum.
+    The drum speed control and sampling are in drum (a DrumController, with the RpmSampler as drum.sampler) and the
+    drum position sensor is in trigger (a TriggeredSwitch).
 
     Methods:
+        setup_cameras: Plans and sends the recording settings to all cameras.
+        measured_save_rate: Returns the measured frames per second saved by the cameras
         start_camera_recording: Starts the camera sensor/record process.
         stop_camera_recording: Stops the camera sensor/record process.
         set_drum_rpm: Sets the desired RPM of the drum.
         get_drum_rpm: Gets the RPM of the drum.
-        change_setting: Changes the settings stored in the settings.json file
+        ramp_to_rpm: Changes the drum speed and waits for it to settle, pausing recording if record_when_stable is set
+        wait_for_saves: Waits for the background file saves to finish
+        save_metrics: Returns the save throughput and backlog of each camera
+        camera_health: Returns the health state, probe latency and failures of each camera
+        find_segments: Returns the recorded segments in a time or drum speed range
+        metrics_summary: Returns a summary of the run metrics
+        switch_timing: Returns how late the camera switches ran against their intended times
+        change_setting: Changes a setting while running and saves it to the settings.json file
         print_settings_to_console: Prints the settings stored in the settings.json file
     """
-    def __init__(self):
+    def __init__(self, scheduler=None, config=None, executor=None, name=''):
+        self.settings = config if config is not None else settings
+        self.name = name
         self.running = False
         self.headers = {"Accept": "application/json",
                         "Content-Type": "application/json",
-                        "api-key": settings['drum_apikey']}
-        self.camera_url1 = settings['camera_controller1']
-        self.camera_url2 = settings['camera_controller2']
-        self.camera_timeout = settings['camera_controller_timeout']
-        self.drum_url = settings['drum_controller']
-        self.drum_timeout = settings['drum_controller_timeout']
-        self.recording_cadence = settings['recording_cadence']
+                        "api-key": self.settings['drum_apikey']}
+        self.camera_timeout = self.settings['camera_controller_timeout']
+        self.recording_cadence = self.settings['recording_cadence']
+        self.scheduler = scheduler if scheduler is not None else MonotonicScheduler('camera-scheduler')
+        self.switch_job = None
+        self.trigger = TriggeredSwitch(self.switch_camera, self.settings, name)
+        self.cameras = CameraPool(camera_urls(self.settings), self.camera_timeout, self.headers, self.__file_save,
+                                  self.__file_saved, self.settings, executor, name)
+        drum_session = EndpointSession(name + '-drum' if name else 'drum', self.settings['drum_controller'],
+                                       self.settings['drum_controller_timeout'], self.headers, self.settings)
+        self.drum = DrumController(drum_session, RpmSampler(drum_session, config=self.settings), self.settings)
+        self.health_monitor = HealthMonitor(self.cameras, self.scheduler, self.__health_changed, self.settings)
+        self.recording_index = RecordingIndex(self.settings['recording_index_path'])
+        self.segments = {}
         self.filename = None
         self.recording_time = None
         self.camera_no = None
+        self.handoffs = {}
+        self.switch_history = deque(maxlen=1000)
+        self.setup_plan = None
+        self.settings.subscribe(self.__settings_changed)
+        start_server(self.settings['metrics_port'])
 
     def setup_cameras(self):
-        """Calculate number of frames to record and send details to camera"""
-        frame_period = int(round((1/settings['camera_frame_rate']) * 1000000000, 0))
-        data_message = {'recMode': settings['camera_recMode'], 'framePeriod': frame_period,
-                        'recMaxFrames': settings['camera_maxframes']}
-        url = self.camera_url1 + '/p'
+        """Plan the number of frames to record, send the details to all cameras at the same time and read them back
+
+        If camera_maxframes is 0 recMaxFrames is planned from the frame rate, resolution and cadence so one
+        cadence window fits in the camera RAM, using the measured save rate of camera_storage once a save has
+        completed. Returns a dictionary of camera id and whether its settings were verified.
+        """
+        plan, data_message = recording_setup(len(self.cameras), self.measured_save_rate(), self.settings)
+        for warning in plan_warnings(plan, self.settings['recording_cadence']):
+            console('CameraClass: %s' % warning)
+            logger.warning('CameraClass: %s', warning)
+        self.setup_plan = plan
+        return self.cameras.fan_out(self.__setup_camera, data_message)
+
+    def measured_save_rate(self):
+        """Returns the frames per second saved to camera_storage, averaged over the cameras, or None if not measured"""
+        rates = [metrics['frames_per_second'] for metrics in self.save_metrics() if metrics['frames_per_second']]
+        return sum(rates) / len(rates) if rates else None
+
+    def __setup_camera(self, camera_id, data_message):
+        """Send the recording settings to a camera and read them back to check they were applied"""
         try:
-            response = requests.post(url, timeout=self.camera_timeout, json=data_message, headers=self.headers)
-            # print(response)
-            if response.status_code == 200:
-                logger.debug('CameraClass: Setup for camera 1 completed')
-            else:
-                logger.warning('CameraClass: Failed to Setup camera 1 - check camera status')
+            response = self.cameras[camera_id].session.post('/p', json=data_message)
+            if response.status_code != 200:
+                logger.warning('CameraClass: Failed to Setup camera %s - check camera status', camera_id)
+                return False
+            response = self.cameras[camera_id].session.get('/p')
+            mismatched = unapplied_settings(data_message, response.json() if response.status_code == 200 else {})
+            if mismatched:
+                logger.warning('CameraClass: Camera %s did not apply %s', camera_id, ', '.join(mismatched))
+                return False
+            logger.debug('CameraClass: Setup for camera %s completed and verified', camera_id)
+            return True
         except requests.Timeout:
-            logger.error('CameraClass: Timeout when setting up camera 1')
-        if settings['camera_qty'] == 2:
-            try:
-                url = self.camera_url2 + '/p'
-                response = requests.post(url, timeout=self.camera_timeout, json=data_message, headers=self.headers)
-                if response.status_code == 200:
-                    logger.debug('CameraClass: Setup for camera 2 completed')
-                else:
-                    logger.warning('CameraClass: Failed to Setup camera 2 - check camera status')
-            except requests.Timeout:
-                logger.error('CameraClass: Failed to Setup camera 2 - check camera status')
-
-    def start_camera_recording(self):
-        """Starts the camera sensor/record process."""
-        print('Starting camera recording')
-        logger.info('CameraClass: starting camera recording')
+            logger.error('CameraClass: Timeout when setting up camera %s', camera_id)
+        except ValueError:
+            logger.error('CameraClass: Camera %s returned invalid settings when read back', camera_id)
+        except requests.RequestException as error:
+            logger.error('CameraClass: Camera %s not reachable when setting up: %s', camera_id, error)
+        return False
+
+    def start_camera_recording(self, anchor=None):
+        """Starts the camera sensor/record process.
+
+        The camera switches run every recording_cadence seconds from the anchor (a time.monotonic() value,
+        default now), so several tombolas given the same anchor switch their cameras at the same moments.
+        If recording_trigger is sensor the first camera starts on the next rotation trigger of the drum
+        position sensor and the cameras switch on each trigger after that.
+        """
+        console('Starting camera recording')
+        logger.info('CameraClass: starting camera recording on %s cameras', len(self.cameras))
         # self.setup_cameras()
         self.running = True
-        self.camera_no = 1
-        self.recording_time = 0
-        self.__start_recording(self.camera_no)
-        threading.Timer(0.1, self.global_timer).start()
+        self.health_monitor.start()
+        self.camera_no = None
+        if self.settings['recording_trigger'] == 'sensor':
+            self.trigger.start()
+            console('CameraClass: Waiting for the drum rotation trigger to start recording')
+            return
+        camera_id = self.cameras.next_camera(None)
+        if camera_id is not None and self.__start_recording(camera_id):
+            self.__open_segment(camera_id)
+            self.camera_no = camera_id
+        elif camera_id is not None:
+            self.cameras.mark_failed(camera_id)
+        self.recording_time = time.monotonic()
+        anchor = anchor if anchor is not None else self.recording_time
+        self.switch_job = self.scheduler.call_every(self.__cadence, self.switch_camera,
+                                                    name='%scamera-switch' % (self.name + '-' if self.name else ''),
+                                                    start=anchor + self.__cadence(),
+                                                    executor=self.switch_job.executor if self.switch_job else None)
 
     def stop_camera_recording(self):
-        """Stops the camera sensor/record process."""
+        """Stops the camera sensor/record process, all cameras are stopped at the same time."""
         self.running = False
-        self.__stop_recording(1)
-        self.__file_save(1, self.filename)
-        self.__stop_recording(2)
-        print('Stopped all camera recording')
+        if self.switch_job is not None:
+            self.switch_job.cancel()
+        self.trigger.stop()
+        self.health_monitor.stop()
+        self.__wait_for_switch()
+        self.__wait_for_handoffs()
+        self.cameras.fan_out(self.__stop_recording)
+        if self.camera_no in self.segments:
+            self.__save_segment(self.camera_no)
+        console('Stopped all camera recording')
         logger.info('CameraClass: Stopping auto recording')
+        if not self.wait_for_saves(self.settings['camera_save_timeout']):
+            logger.warning('CameraClass: File saves still running when recording stopped')
+        logger.info(self.metrics_summary())
 
-    def global_timer(self):
-        """used when running to run times events"""
-        if self.running:
-            timerthread = threading.Timer(1, self.global_timer)
-            timerthread.start()
-            if self.recording_time == settings['recording_cadence']:
-                self.switch_camera()
-            else:
-                self.recording_time += 1
+    @staticmethod
+    def metrics_summary():
+        """Returns a summary of the request latency, error, switch and save metrics of the run"""
+        return registry.summary()
+
+    def wait_for_saves(self, timeout=None):
+        """Wait for the file saves on all cameras to finish, returns False if the timeout expired first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for camera_id in self.cameras.ids():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self.cameras[camera_id].save_queue.wait(remaining):
+                return False
+        return True
+
+    def save_metrics(self):
+        """Returns the save throughput and backlog of each camera"""
+        return [self.cameras[camera_id].save_queue.metrics() for camera_id in self.cameras.ids()]
+
+    def camera_health(self):
+        """Returns the health state, probe latency and failure statistics of each camera"""
+        return self.health_monitor.status()
+
+    def __health_changed(self, camera_id, previous, state):
+        """Switch straight away to another camera if the recording camera goes down"""
+        executor = self.switch_job.executor if self.switch_job is not None else self.trigger.executor
+        if state == 'down' and self.running and camera_id == self.camera_no and executor is not None:
+            console('CameraClass: Camera %s is down, switching cameras now' % camera_id)
+            logger.warning('CameraClass: Camera %s is down while recording, failing over', camera_id)
+            self.scheduler.call_later(0, self.switch_camera, name='camera-failover', executor=executor)
+        elif previous == 'down':
+            console('CameraClass: Camera %s is back, state %s' % (camera_id, state))
+
+    def switch_timing(self):
+        """Returns the count, mean and maximum lateness (seconds) of the switches against their intended times"""
+        if self.switch_job is None:
+            return {'runs': 0, 'mean_lateness': None, 'max_lateness': None, 'skipped': 0}
+        return self.switch_job.timing_summary()
+
+    def __cadence(self):
+        """Read the recording cadence each time the switch is re-armed so a change takes effect while running"""
+        return float(self.settings['recording_cadence'])
 
     def switch_camera(self):
-        """save the current set of images and then switch to the other camera"""
-        print('Recording time is up - switching cameras now')
-        self.recording_time = 0
-        if self.camera_no == 1:
-            self.camera_no = 2
-            self.__flush_recording(2)
-            self.__start_recording(2)
-            self.__stop_recording(1)
-            self.__file_save(1, self.filename)
-        else:
-            self.camera_no = 1
-            self.__flush_recording(1)
-            self.__start_recording(1)
-            self.__stop_recording(2)
-            self.__file_save(2, self.filename)
-        print('CameraClass: Switched completed to camera %s' % self.camera_no)
+        """Hand recording over to the next camera in the pool then stop and save the outgoing camera.
+
+        The outgoing camera is only sent stopRecording once the incoming camera has acknowledged
+        startRecording, so the two recordings always overlap. The stop and file save of the outgoing
+        camera run on the pool's thread pool so they do not hold up the timer. The measured overlap
+        and gap of each switch are kept in switch_history, the gap being the time from stopRecording
+        being sent to the last camera recording until startRecording was acknowledged by the next one.
+        With a single camera the switch alternates between a recording window and a saving window.
+        """
+        if not self.running:
+            return
+        if self.switch_job is not None and self.switch_job.timing:
+            intended, actual = self.switch_job.timing[-1]
+            SWITCH_LATENESS.set(actual - intended, **self.cameras.labels)
+        console('Recording time is up - switching cameras now')
+        outgoing = self.camera_no
+        incoming = self.cameras.next_camera(outgoing)
+        if incoming is None:
+            incoming = self.__apply_backpressure(outgoing)
+            if incoming is None:
+                return
+        pending = self.handoffs.get(incoming)
+        if pending is not None:
+            wait([pending])
+        handoff = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'outgoing': outgoing,
+                   'incoming': incoming, 'start_sent': None, 'start_ack': None, 'stop_sent': None,
+                   'stop_ack': None, 'overlap': None, 'gap': None}
+        self.__flush_recording(incoming)
+        handoff['start_sent'] = time.monotonic()
+        started = self.__start_recording(incoming)
+        handoff['start_ack'] = time.monotonic()
+        if not started:
+            self.cameras.mark_failed(incoming)
+            SWITCH_COUNT.inc(outcome='failed', **self.cameras.labels)
+            console('CameraClass: Camera %s did not start, camera %s left recording' % (incoming, outgoing))
+            logger.warning('CameraClass: Camera %s did not start, camera %s left recording', incoming, outgoing)
+            self.switch_history.append(handoff)
+            return
+        self.cameras.mark_ok(incoming)
+        self.__open_segment(incoming)
+        self.camera_no = incoming
+        if outgoing is None and self.switch_history and self.switch_history[-1]['incoming'] is None:
+            handoff['gap'] = handoff['start_ack'] - self.switch_history[-1]['stop_sent']
+            self.switch_history.append(handoff)
+            logger.info('CameraClass: Camera %s started %.1f ms after the last camera stopped', incoming,
+                        handoff['gap'] * 1000)
+        self.recording_time = time.monotonic()
+        if outgoing is not None:
+            self.handoffs[outgoing] = self.cameras.executor.submit(self.__retire_camera, outgoing, handoff, True)
+        console('CameraClass: Switched completed to camera %s' % self.camera_no)
+
+    def __apply_backpressure(self, outgoing):
+        """Decide what to do when no camera is free to take over, returns the camera to switch to or None"""
+        waiting = self.cameras.next_camera(outgoing, include_busy=True)
+        if waiting is None:
+            if len(self.cameras) == 1 and outgoing is not None:
+                self.camera_no = None
+                handoff = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'outgoing': outgoing,
+                           'incoming': None, 'start_sent': None, 'start_ack': None, 'stop_sent': None,
+                           'stop_ack': None, 'overlap': None, 'gap': None}
+                self.handoffs[outgoing] = self.cameras.executor.submit(self.__retire_camera, outgoing, handoff, False)
+                console('CameraClass: Only 1 camera installed, camera %s stopped to save' % outgoing)
+            elif outgoing is not None:
+                logger.warning('CameraClass: No other camera responding, camera %s keeps recording', outgoing)
+            else:
+                logger.error('CameraClass: No camera responding, nothing is recording')
+            return None
+        if self.settings['save_backpressure'] == 'block':
+            logger.warning('CameraClass: Waiting for camera %s to finish saving before switching', waiting)
+            self.cameras[waiting].save_queue.wait()
+            return waiting
+        SWITCH_COUNT.inc(outcome='deferred', **self.cameras.labels)
+        console('CameraClass: Camera %s still saving, camera %s keeps recording' % (waiting, outgoing))
+        logger.warning('CameraClass: Camera %s still saving, extending camera %s recording by one cadence',
+                       waiting, outgoing)
+        return None
+
+    def __retire_camera(self, camera_id, handoff, overlapped):
+        """Stop and save the outgoing camera of a switch and record the measured overlap and gap.
+
+        The segment is always closed and its save queued, even if the stop fails, so a camera that drops
+        its connection does not block later switches to it or lose its segment from the index.
+        """
+        try:
+            handoff['stop_sent'] = time.monotonic()
+            stopped = self.__stop_recording(camera_id)
+            handoff['stop_ack'] = time.monotonic()
+            if overlapped:
+                handoff['overlap'] = handoff['stop_sent'] - handoff['start_ack']
+                handoff['gap'] = max(0.0, handoff['start_ack'] - handoff['stop_sent'])
+                SWITCH_OVERLAP.set(handoff['overlap'], **self.cameras.labels)
+                SWITCH_COUNT.inc(outcome='completed' if stopped else 'stop_failed', **self.cameras.labels)
+                logger.info('CameraClass: Switch %s -> %s overlap %.1f ms', camera_id, handoff['incoming'],
+                            handoff['overlap'] * 1000)
+            self.switch_history.append(handoff)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('CameraClass: Stopping camera %s failed', camera_id)
+        finally:
+            try:
+                if camera_id in self.segments:
+                    self.__save_segment(camera_id)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('CameraClass: Saving the segment of camera %s failed', camera_id)
+
+    def __open_segment(self, camera_id):
+        """Note the start of a recorded segment on a camera"""
+        self.segments[camera_id] = open_segment(camera_id, self.drum.setpoint)
+
+    def __close_segment(self, camera_id):
+        """Add the segment that has just stopped on a camera to the recording index, returns its filename and frames"""
+        segment = close_segment(self.segments.pop(camera_id), self.settings['camera_frame_rate'], self.name,
+                                self.setup_plan['recMaxFrames'] if self.setup_plan else None)
+        trace = self.drum.sampler.buffer.samples(segment['start_monotonic'], segment['stop_monotonic'])
+        segment['measured_rpm'] = sum(sample[2] for sample in trace) / len(trace) if trace else None
+        self.filename = segment['filename']
+        self.recording_index.add_segment(segment)
+        return segment['filename'], segment['frame_count']
+
+    def __save_segment(self, camera_id):
+        """Close the segment that has just stopped on a camera and queue its save, a segment that does not fit
+        in the save queue is marked not_saved in the recording index"""
+        filename, frame_count = self.__close_segment(camera_id)
+        if not self.cameras[camera_id].save_queue.submit(filename, frame_count):
+            self.recording_index.set_save_status(filename, 'not_saved')
+
+    def __file_saved(self, camera_id, filename, saved):
+        """Record the outcome of a background file save in the recording index"""
+        logger.debug('CameraClass: Camera %s save of %s finished saved = %s', camera_id, filename, saved)
+        self.recording_index.set_save_status(filename, 'completed' if saved else 'failed')
+
+    def find_segments(self, start_wall=None, end_wall=None, min_rpm=None, max_rpm=None):
+        """Returns the recorded segments in a wall clock time range (time.time() values) or drum speed range"""
+        if min_rpm is not None or max_rpm is not None:
+            segments = self.recording_index.find_by_rpm(min_rpm if min_rpm is not None else 0.0,
+                                                        max_rpm if max_rpm is not None else float('inf'))
+            return [segment for segment in segments
+                    if (start_wall is None or segment['stop_wall'] >= start_wall)
+                    and (end_wall is None or segment['start_wall'] <= end_wall)]
+        return self.recording_index.find_by_time(start_wall if start_wall is not None else 0.0,
+                                                 end_wall if end_wall is not None else float('inf'))
+
+    def __wait_for_switch(self):
+        """Wait for a camera switch already running on the cadence or a rotation trigger, cancelling the job does
+        not stop a switch that has started and it may still start a camera"""
+        self.trigger.wait()
+        if self.switch_job is not None and self.switch_job.future is not None:
+            wait([self.switch_job.future])
+
+    def __wait_for_handoffs(self):
+        """Wait for any outgoing camera that is still being stopped and saved"""
+        wait([future for future in self.handoffs.values() if future is not None])
 
     def __flush_recording(self, camera_id):
         """Send a Start recording API call to the camera"""
-        if camera_id > settings['camera_qty']:
-            print('Only 1 camera installed skipping flush recording camera 2')
-            return
-        if camera_id == 1:
-            url = self.camera_url1 + '/flushRecording'
-        else:
-            url = self.camera_url2 + '/flushRecording'
         try:
-            response = requests.get(url, timeout=self.camera_timeout, headers=self.headers)
+            response = self.cameras[camera_id].session.get('/flushRecording')
             if response.status_code == 200:
-                print('CameraClass: Camera %s flush recording' % camera_id)
+                console('CameraClass: Camera %s flush recording' % camera_id)
                 logger.debug('CameraClass: flush recording %s', camera_id)
-            else:
-                print('CameraClass: Failed to flush recording check camera. status = %s' % camera_id)
-                logger.warning('CameraClass: Failed to flush recording check camera. status = %s', camera_id)
+                return True
+            console('CameraClass: Failed to flush recording check camera. status = %s' % camera_id)
+            logger.warning('CameraClass: Failed to flush recording check camera. status = %s', camera_id)
         except requests.Timeout:
-            print('CameraClass: Timeout when flushing recording camera %s' % camera_id)
+            console('CameraClass: Timeout when flushing recording camera %s' % camera_id)
             logger.error('CameraClass: Timeout when flushing recordingcamera %s', camera_id)
+        except requests.RequestException as error:
+            console('CameraClass: Camera %s not reachable when flushing recording' % camera_id)
+            logger.error('CameraClass: Camera %s not reachable when flushing recording: %s', camera_id, error)
+        return False
 
     def __start_recording(self, camera_id):
         """Send a Start recording API call to the camera"""
-        if camera_id > settings['camera_qty']:
-            print('Only 1 camera installed skipping starting camera 2')
-            return
-        if camera_id == 1:
-            url = self.camera_url1 + '/startRecording'
-        else:
-            url = self.camera_url2 + '/startRecording'
         try:
-            response = requests.get(url, timeout=self.camera_timeout, headers=self.headers)
+            response = self.cameras[camera_id].session.get('/startRecording')
             if response.status_code == 200:
-                print('CameraClass: Camera %s starting recording' % camera_id)
+                console('CameraClass: Camera %s starting recording' % camera_id)
                 logger.debug('CameraClass: Recording started camera %s', camera_id)
-            else:
-                print('CameraClass: Failed to start recording check camera. status = %s' % camera_id)
-                logger.warning('CameraClass: Failed to start recording check camera. status = %s', camera_id)
+                return True
+            console('CameraClass: Failed to start recording check camera. status = %s' % camera_id)
+            logger.warning('CameraClass: Failed to start recording check camera. status = %s', camera_id)
         except requests.Timeout:
-            print('CameraClass: Timeout when starting the camera %s' % camera_id)
+            console('CameraClass: Timeout when starting the camera %s' % camera_id)
             logger.error('CameraClass: Timeout when starting the camera %s', camera_id)
+        except requests.RequestException as error:
+            console('CameraClass: Camera %s not reachable when starting recording' % camera_id)
+            logger.error('CameraClass: Camera %s not reachable when starting recording: %s', camera_id, error)
+        return False
 
     def __stop_recording(self, camera_id):
         """Send a Stop recording API call to the camera"""
-        self.filename = datetime.now().strftime('UCL-Tombola_%Y-%m-%d_%H-%M-%S')
-        if camera_id > settings['camera_qty']:
-            print('Only 1 camera installed skipping stopping camera 2')
-            return
-        if camera_id == 1:
-            url = self.camera_url1 + '/stopRecording'
-        else:
-            url = self.camera_url2 + '/stopRecording'
         try:
-            response = requests.get(url, timeout=self.camera_timeout, headers=self.headers)
+            response = self.cameras[camera_id].session.get('/stopRecording')
             if response.status_code == 200:
-                print('CameraClass: Camera %s stopping recording' % camera_id)
+                console('CameraClass: Camera %s stopping recording' % camera_id)
                 logger.debug('CameraClass: Recording stopped camera %s', camera_id)
-            else:
-                print('CameraClass: Failed to stop recording - check camera %s status' % camera_id)
-                logger.warning('CameraClass: Failed to stop recording - check camera %s status', camera_id)
+                return True
+            console('CameraClass: Failed to stop recording - check camera %s status' % camera_id)
+            logger.warning('CameraClass: Failed to stop recording - check camera %s status', camera_id)
         except requests.Timeout:
-            print('CameraClass: Timeout when stopping the camera %s' % camera_id)
+            console('CameraClass: Timeout when stopping the camera %s' % camera_id)
             logger.error('CameraClass: Timeout when stopping the camera %s', camera_id)
+        except requests.RequestException as error:
+            console('CameraClass: Camera %s not reachable when stopping recording' % camera_id)
+            logger.error('CameraClass: Camera %s not reachable when stopping recording: %s', camera_id, error)
+        return False
 
     def __file_save(self, camera_id, filename):
         """Send a file save API call to the camera - format and file extension are in the settings.json file"""
-        if camera_id > settings['camera_qty']:
-            print('Only 1 camera installed skipping file saving to camera 2')
-        if camera_id == 1:
-            url = self.camera_url1 + '/startFilesave'
-        else:
-            url = self.camera_url2 + '/startFilesave'
         payload = {'filename': filename,
-                   'device': settings['camera_storage'],
-                   'format': settings['camera_format']}
+                   'device': self.settings['camera_storage'],
+                   'format': self.settings['camera_format']}
         try:
-            response = requests.post(url, json=payload, timeout=self.camera_timeout, headers=self.headers)
+            response = self.cameras[camera_id].session.post('/startFilesave', json=payload)
             if response.status_code == 200:
-                print('CameraClass: File saved camera = %s filename = %s' % (camera_id, filename))
-                logger.debug('CameraClass: File saved')
-            else:
-                print('CameraClass: Failed to save file please check camera. status code = %s' % response.status_code)
-                logger.warning('CameraClass: Failed to save file please check camera. status code = %s',
-                               response.status_code)
+                console('CameraClass: File save started camera = %s filename = %s' % (camera_id, filename))
+                logger.debug('CameraClass: File save started')
+                return True
+            console('CameraClass: Failed to save file please check camera. status code = %s' % response.status_code)
+            logger.warning('CameraClass: Failed to save file please check camera. status code = %s',
+                           response.status_code)
         except requests.Timeout:
             logger.error('CameraClass: Timeout when saving a file to the camera, check it is on and connected')
+        except requests.RequestException as error:
+            logger.error('CameraClass: Camera %s not reachable when saving %s: %s', camera_id, filename, error)
+        return False
 
     def set_drum_rpm(self, speed: float):
         """Sets the drum RPM (revolutions per minute) by sending a POST request to
@@ -227,51 +485,82 @@ class CameraClass:
 
         Attempts to send the specified speed information as a JSON payload to the
         tombola controller api endpoint. If the request succeeds, the speed value is
-        returned. If the request times out, an error message is logged, and a
-        default value is returned.
+        returned. If the request fails or the controller does not accept the speed,
+        an error message is logged, and a default value is returned.
 
         Args:
             speed (float): Desired drum speed in revolutions per minute (0.1 to 79.9).
 
         Returns:
             float: The RPM value that was set if the request succeeds, or 0.0
-            if the request times out.
+            if the request fails.
         """
-        payload = {"setrpm": speed}
-        try:
-            requests.post(self.drum_url, json=payload, timeout=self.drum_timeout, headers=self.headers)
-            print('CameraClass: Drum speed set to %s' % str(speed))
+        if self.drum.set_rpm(speed):
+            console('CameraClass: Drum speed set to %s' % str(speed))
             return speed
-        except requests.Timeout:
-            print('CameraClass: set_drum_speed request timed out, check the raspberry pi')
-            logger.error("CameraClass: set_drum_speed request timed out, check the raspberry pi")
-            return 0.0
+        console('CameraClass: set_drum_speed request failed, check the raspberry pi')
+        return 0.0
+
+    def ramp_to_rpm(self, speed: float, rate=None, tolerance=None, window=None, timeout=None):
+        """Change the drum speed, ramping at up to rate rpm per second (drum_ramp_rate if not given), and wait
+        until the measured speed has settled within tolerance rpm for window seconds.
+
+        If record_when_stable is set and the cameras are recording, the active camera is stopped and saved
+        before the speed changes and recording restarts once the drum has settled, so no camera RAM or save
+        time is spent on footage of the drum speeding up or slowing down.
 
-    def get_drum_rpm(self):
+        Returns:
+            bool: True if the drum settled before the timeout.
         """
-        Fetches the drum's rotations per minute (RPM) from a remote service.
+        paused = self.settings['record_when_stable'] and self.running
+        if paused:
+            self.__pause_recording()
+        stable = self.drum.ramp_to_rpm(speed, rate, tolerance, window, timeout)
+        console('CameraClass: Drum %s at %s rpm' % ('settled' if stable else 'not settled', speed))
+        if paused:
+            if not stable:
+                logger.warning('CameraClass: Restarting recording before the drum has settled at %s rpm', speed)
+            self.start_camera_recording()
+        return stable
 
-        This function sends a POST request to the tombola controller api endpoint with a payload requesting
-        the RPM of the drum. If the request is successful, the RPM value is extracted and
-        returned. In case of a timeout, it logs an error and returns a default value of 0.0.
+    def __pause_recording(self):
+        """Stop the cadence and save the active camera's segment while the drum speed changes"""
+        self.running = False
+        if self.switch_job is not None:
+            self.switch_job.cancel()
+        self.__wait_for_switch()
+        self.__wait_for_handoffs()
+        if self.camera_no is not None:
+            self.__stop_recording(self.camera_no)
+            if self.camera_no in self.segments:
+                self.__save_segment(self.camera_no)
+        self.camera_no = None
+        console('CameraClass: Recording paused until the drum speed settles')
+        logger.info('CameraClass: Recording paused until the drum speed settles')
 
-        Raises:
-            KeyError: If the expected 'rpm' key is not present in the JSON response.
+    def get_drum_rpm(self, live=False):
+        """
+        Fetches the drum's rotations per minute (RPM) from a remote service.
+
+        While the drum sampler is running the latest sampled value is returned from memory, as long as it is
+        no older than a few sample periods. Otherwise (or if live is True) this function sends a POST request
+        to the tombola controller api endpoint with a payload requesting the RPM of the drum. If the request
+        is successful, the RPM value is extracted and returned. If the drum controller does not answer, it logs
+        an error and returns a default value of 0.0.
 
         Args:
-            None
+            live (bool): Always read the speed from the drum controller rather than the sampler.
 
         Returns:
-            float: The RPM of the drum, or 0.0 if the request times out.
+            float: The RPM of the drum, or 0.0 if the drum controller does not answer.
         """
-        payload = {"rpm": True}
-        try:
-            response = requests.post(self.drum_url, json=payload, timeout=self.drum_timeout, headers=self.headers)
-            rpm = response.json()['rpm']
-            return rpm
-        except requests.Timeout:
-            logger.error("CameraClass: set_drum_speed request timed out")
+        if not live and self.drum.sampler.running and self.drum.sampler.fresh_sample() is None:
+            logger.warning('CameraClass: No recent drum speed sample, reading the drum controller')
+        sample = self.drum.measured_rpm(live)
+        if sample is None:
+            logger.error('CameraClass: get_drum_rpm request failed, check the drum controller')
             return 0.0
+        return sample[1]
 
     def print_settings_to_console(self):
         """Shows the current set of settings in the Json file"""
@@ -279,10 +568,29 @@ class CameraClass:
         print('\nUCL Tombola App Settings:')
         print('%s%s' % (format_string.format('Setting'), 'Value'))
         print('%s%s' % (format_string.format('-------'), '-----'))
-        for item in settings:
-            print('%s%s' % (format_string.format(item), settings[item]))
+        for item in self.settings:
+            print('%s%s' % (format_string.format(item), self.settings[item]))
 
     def change_setting(self, setting, value):
-        """Update the setting in the settings json file"""
-        settings[setting] = value
-        writesettings()
+        """Update the setting, it takes effect straight away and is saved to the settings json file shortly after"""
+        self.settings[setting] = value
+
+    def __sessions(self):
+        """Returns the pooled sessions of all the cameras"""
+        return [self.cameras[camera_id].session for camera_id in self.cameras.ids()]
+
+    def __settings_changed(self, changes):
+        """Apply changed settings to the running object"""
+        if 'camera_controller_timeout' in changes:
+            self.camera_timeout = changes['camera_controller_timeout']
+            for session in self.__sessions():
+                session.timeout = self.camera_timeout
+        if 'drum_controller_timeout' in changes:
+            self.drum.session.timeout = changes['drum_controller_timeout']
+        if 'drum_apikey' in changes:
+            self.headers['api-key'] = changes['drum_apikey']
+            for session in self.__sessions() + [self.drum.session]:
+                session.session.headers['api-key'] = changes['drum_apikey']
+        if 'recording_cadence' in changes:
+            self.recording_cadence = changes['recording_cadence']
+        logger.debug('CameraClass: Settings changed %s', ', '.join(changes))
@@ -0,0 +1,114 @@
+"""
+Connection Pool Module
+
+Keep-alive HTTP sessions for the Chronos cameras and the UCL Tombola drum controller.
+
+Each endpoint (camera 1, camera 2 and the drum controller) gets its own requests.Session
+with a pooled HTTPAdapter, so repeated API calls re-use an open TCP connection instead of
+paying the connection setup cost on every request. Pool size and retry/backoff policy are
+read from the settings.json file and the latency of every request is logged at debug level and
+recorded in the metrics with its errors and timeouts.
+
+Settings used:
+    - http_pool_size: number of keep-alive connections held open per endpoint
+    - http_retries: number of times a failed connection attempt is retried
+    - http_backoff_factor: backoff factor (seconds) between connection retries
+
+Usage:
+    from connection_pool import EndpointSession
+
+    camera = EndpointSession('camera1', 'http://192.168.0.20/control', timeout=0.5, headers=headers)
+    response = camera.get('/startRecording')
+    REQUEST_SECONDS.observe(0.012, **request_labels('camera1', '/startRecording'))
+"""
+
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app_control import settings
+from logmanager import logger
+from metrics import registry
+
+
+REQUEST_SECONDS = registry.histogram('tombola_request_seconds', 'Latency of camera and drum API requests')
+REQUEST_ERRORS = registry.counter('tombola_request_errors_total', 'Camera and drum API requests that failed')
+REQUEST_TIMEOUTS = registry.counter('tombola_request_timeouts_total', 'Camera and drum API requests that timed out')
+
+
+def request_labels(name, path=''):
+    """Returns the metric labels of a request to an endpoint, shared by the sync and asyncio clients"""
+    return {'endpoint': name, 'path': path or '/'}
+
+
+class EndpointSession:
+    """
+    EndpointSession
+
+    A pooled, keep-alive HTTP session bound to a single base url.
+    Connection errors are retried with a backoff, read errors are not retried as the camera
+    and drum commands are not idempotent (a repeated startRecording would restart the camera),
+    so a slow response is raised as a requests.Timeout.
+
+    Methods:
+        get: Send a GET request to a path on the endpoint
+        post: Send a POST request to a path on the endpoint
+        close: Close all pooled connections
+    """
+    def __init__(self, name, base_url, timeout, headers=None, config=None):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.last_latency = None
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.settings = config if config is not None else settings
+        retry = Retry(total=self.settings['http_retries'], connect=self.settings['http_retries'], read=False, status=0,
+                      backoff_factor=self.settings['http_backoff_factor'], allowed_methods=None,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.settings['http_pool_size'],
+                              max_retries=retry, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+        if headers:
+            self.session.headers.update(headers)
+
+    def request(self, method, path='', **kwargs):
+        """Send a request to the endpoint, log how long it took and record it in the metrics"""
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.base_url + path
+        labels = request_labels(self.name, path)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                REQUEST_ERRORS.inc(status=response.status_code, **labels)
+            return response
+        except requests.Timeout:
+            REQUEST_TIMEOUTS.inc(**labels)
+            raise
+        except requests.RequestException:
+            REQUEST_ERRORS.inc(status='connection', **labels)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.last_latency = latency
+                self.request_count += 1
+            REQUEST_SECONDS.observe(latency, **labels)
+            logger.debug('EndpointSession: %s %s %s took %.1f ms', self.name, method, url, latency * 1000)
+
+    def get(self, path='', **kwargs):
+        """Send a GET request to a path on the endpoint"""
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path='', **kwargs):
+        """Send a POST request to a path on the endpoint"""
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
@@ -0,0 +1,164 @@
+"""
+Drum Control Module
+
+Closed-loop speed control of the UCL Tombola drum.
+
+The DrumController sends a new speed to the drum controller, checking that it was accepted, and then
+polls the measured speed until it has settled. The drum counts as settled once every sample in a
+rolling window of drum_settle_window seconds is within drum_settle_tolerance rpm of the set speed.
+While the RpmSampler is running its samples are used, otherwise the drum is polled directly at
+drum_poll_rate. A speed change can be made as a rate-limited ramp, with the set speed moved towards
+the target in small steps, rather than one step that makes the drum lurch.
+
+Settings used:
+    - drum_poll_rate: samples per second read while waiting for the drum to settle
+    - drum_settle_tolerance: rpm either side of the set speed that counts as settled
+    - drum_settle_window: seconds the speed must stay in the tolerance band
+    - drum_settle_timeout: seconds to wait for the drum to settle before giving up
+    - drum_ramp_rate: rpm per second for ramped speed changes, 0 to step straight to the new speed
+    - drum_ramp_step_time: seconds between set speed changes during a ramp
+
+Usage:
+    from drum_control import DrumController
+
+    drum = DrumController(drum_session, rpm_sampler)
+    if drum.ramp_to_rpm(72, rate=2.0):
+        print(drum.last_settle)
+"""
+
+import math
+import threading
+import time
+from collections import deque
+import requests
+from app_control import settings
+from logmanager import logger
+from metrics import registry
+
+
+SETTLE_SECONDS = registry.histogram('tombola_drum_settle_seconds', 'Time taken for the drum speed to settle')
+
+
+class DrumController:
+    """
+    DrumController
+
+    Sets the drum speed and waits for the measured speed to settle inside a tolerance band.
+
+    Methods:
+        set_rpm: Send a new speed to the drum, returns True if the controller accepted it
+        measured_rpm: Returns the latest (monotonic time, rpm) measured or None
+        ramp_to_rpm: Change to a new speed, optionally at a limited rate, and wait for it to settle
+        wait_until_stable: Wait until the measured speed has stayed in the tolerance band for the settle window
+        abort: Stop a ramp or wait that is in progress
+    """
+    def __init__(self, drum_session, sampler=None, config=None):
+        self.session = drum_session
+        self.settings = config if config is not None else settings
+        self.sampler = sampler
+        self.setpoint = None
+        self.errors = 0
+        self.last_settle = None
+        self.aborted = threading.Event()
+
+    def set_rpm(self, speed):
+        """Send a new speed to the drum, returns True if the controller accepted it"""
+        try:
+            response = self.session.post(json={'setrpm': speed})
+        except requests.RequestException as error:
+            logger.error('DrumController: Could not set the drum speed to %s: %s', speed, error)
+            return False
+        if response.status_code != 200:
+            logger.error('DrumController: Drum controller rejected speed %s, status = %s', speed, response.status_code)
+            return False
+        self.setpoint = speed
+        return True
+
+    def measured_rpm(self, live=False):
+        """Returns the latest (monotonic time, rpm) from the sampler while its samples are recent, otherwise (or if
+        live is True) from the drum, or None if the drum does not answer"""
+        if self.sampler is not None and not live:
+            sample = self.sampler.fresh_sample()
+            if sample is not None:
+                return sample[0], sample[2]
+        try:
+            response = self.session.post(json={'rpm': True})
+            return time.monotonic(), float(response.json()['rpm'])
+        except (requests.RequestException, ValueError, KeyError) as error:
+            self.errors += 1
+            logger.debug('DrumController: Drum speed read failed: %s', error)
+            return None
+
+    def abort(self):
+        """Stop a ramp or wait that is in progress"""
+        self.aborted.set()
+
+    def ramp_to_rpm(self, target, rate=None, tolerance=None, window=None, timeout=None):
+        """Change to a new speed at up to rate rpm per second, returns True once the drum has settled"""
+        rate = self.settings['drum_ramp_rate'] if rate is None else rate
+        self.aborted.clear()
+        if rate and rate > 0:
+            if self.setpoint is not None:
+                current = self.setpoint
+            else:
+                sample = self.measured_rpm()
+                current = sample[1] if sample is not None else 0.0
+            step_time = self.settings['drum_ramp_step_time']
+            steps = max(1, int(math.ceil(abs(target - current) / (rate * step_time))))
+            logger.info('DrumController: Ramping drum from %s to %s rpm over %.1f s', current, target,
+                        steps * step_time)
+            start = time.monotonic()
+            for step in range(1, steps + 1):
+                if self.aborted.wait(max(0.0, start + (step - 1) * step_time - time.monotonic())):
+                    logger.warning('DrumController: Ramp to %s rpm aborted', target)
+                    return False
+                value = target if step == steps else round(current + (target - current) * step / steps, 3)
+                if not self.set_rpm(value):
+                    return False
+        elif not self.set_rpm(target):
+            return False
+        return self.__wait_stable(target, tolerance, window, timeout)
+
+    def wait_until_stable(self, target=None, tolerance=None, window=None, timeout=None):
+        """Wait until the measured speed has stayed within tolerance of the target for the settle window,
+        returns False if it has not settled by the timeout"""
+        self.aborted.clear()
+        return self.__wait_stable(self.setpoint if target is None else target, tolerance, window, timeout)
+
+    def __wait_stable(self, target, tolerance, window, timeout):
+        """Poll the measured speed until the rolling window is all inside the tolerance band"""
+        tolerance = self.settings['drum_settle_tolerance'] if tolerance is None else tolerance
+        window = self.settings['drum_settle_window'] if window is None else window
+        timeout = self.settings['drum_settle_timeout'] if timeout is None else timeout
+        if target is None:
+            raise ValueError('DrumController: No target speed to wait for')
+        period = 1 / float(self.settings['drum_poll_rate'])
+        samples = deque()
+        start = time.monotonic()
+        deadline = start
+        stable = False
+        while not stable and time.monotonic() - start < timeout:
+            sample = self.measured_rpm()
+            if sample is not None and (not samples or sample[0] > samples[-1][0]):
+                samples.append(sample)
+                while len(samples) > 1 and samples[1][0] <= sample[0] - window:
+                    samples.popleft()
+                stable = (samples[0][0] <= sample[0] - window
+                          and all(abs(rpm - target) <= tolerance for _, rpm in samples))
+            if stable:
+                break
+            deadline += period
+            if self.aborted.wait(max(0.0, deadline - time.monotonic())):
+                logger.warning('DrumController: Wait for %s rpm aborted', target)
+                break
+        seconds = time.monotonic() - start
+        speeds = [rpm for _, rpm in samples]
+        self.last_settle = {'target': target, 'stable': stable, 'seconds': seconds,
+                            'mean_rpm': sum(speeds) / len(speeds) if speeds else None,
+                            'spread': max(speeds) - min(speeds) if speeds else None}
+        if stable:
+            SETTLE_SECONDS.observe(seconds)
+            logger.info('DrumController: Drum settled at %s rpm in %.1f s', target, seconds)
+        else:
+            logger.warning('DrumController: Drum not settled at %s rpm after %.1f s', target, seconds)
+        return stable
@@ -0,0 +1,478 @@
+"""
+Drum Sensor Module
+
+Drum position sensing for recording triggered by the rotation of the drum rather than a fixed cadence.
+
+A sensor thread reads the drum position sensor on monotonic deadlines at sensor_sample_rate and appends
+each (monotonic time, value) sample to a SensorBuffer. The buffer is a bounded deque with a single writer,
+so the sensor thread never waits on a lock held by a reader. Each sample is checked for a rotation edge:
+a rising edge of the position switch on an FT232H GPIO pin, or the drum angle measured by an LIS3DH
+accelerometer passing sensor_trigger_angle. Edges closer together than sensor_debounce_time are ignored.
+Every sensor_rotations_per_segment rotations a trigger is raised: an FT232H output wired to the camera
+trigger input is pulsed if one is set, and the trigger callbacks are called from the sensor thread.
+
+Samples are written to a trace file for the run, and a recorded trace can be replayed through the same
+edge detection and callbacks, so trigger-based recording can be tested without the hardware.
+
+Settings used:
+    - sensor_type: gpio (position switch), lis3dh (accelerometer on the drum) or replay (a recorded trace)
+    - sensor_pin: FT232H pin of the position switch, for example C0
+    - sensor_sample_rate: samples per second read from the sensor
+    - sensor_buffer_size: number of samples held in memory
+    - sensor_debounce_time: seconds after a rotation edge during which further edges are ignored
+    - sensor_trigger_angle: drum angle in degrees counted as the start of a rotation by the lis3dh sensor
+    - sensor_rotations_per_segment: rotations between triggers
+    - sensor_trigger_output: FT232H pin pulsed on each trigger for the camera trigger input, blank for none
+    - sensor_trigger_pulse: seconds the trigger output is held high
+    - sensor_log_dir: directory for the per-run trace files
+    - sensor_replay_file: trace file used by the replay sensor
+
+Usage:
+    from drum_sensor import create_sensor
+
+    sensor = create_sensor()
+    sensor.subscribe(lambda event: print(event['rotation'], event['rpm']))
+    sensor.start()
+    monotonic_time, value = sensor.buffer.latest()
+    sensor.stop()
+
+    trigger = TriggeredSwitch(camera.switch_camera)     switch cameras on each trigger
+    trigger.start()
+
+    python drum_sensor.py record --seconds 60                     record a trace from the sensor
+    python drum_sensor.py synthetic trace.csv --rpm 72 --seconds 60  write a trace of a drum at 72 rpm
+    python drum_sensor.py replay trace.csv --time-scale 10         replay a trace and print the triggers
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime
+from app_control import settings
+from logmanager import logger
+from metrics import registry
+
+
+SENSOR_EVENTS = registry.counter('tombola_sensor_events_total', 'Drum rotation edges by outcome')
+SENSOR_OVERRUNS = registry.counter('tombola_sensor_overruns_total', 'Sensor reads that missed their deadline')
+TRIGGER_LATENCY = registry.histogram('tombola_trigger_latency_seconds', 'Time from a drum rotation trigger to '
+                                     'the start of the camera switch')
+
+
+def hardware(pin=None):
+    """Returns the Blinka board module (and the digitalio module), imported only when a sensor is used"""
+    try:
+        import board  # pylint: disable=import-outside-toplevel
+        import digitalio  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise ImportError('adafruit-blinka is needed for the drum sensor: pip install adafruit-blinka and set '
+                          'BLINKA_FT232H=1') from error
+    if pin is not None and not hasattr(board, pin):
+        raise ValueError('DrumSensor: %s is not a pin of the FT232H' % pin)
+    return board, digitalio
+
+
+class SensorBuffer:
+    """
+    SensorBuffer
+
+    A bounded buffer of (monotonic time, value) samples written by the sensor thread. Appending to a deque is
+    atomic, and readers take a copy, so the sensor thread never waits for a reader.
+
+    Methods:
+        append: Add a sample
+        latest: Returns the most recent sample or None
+        samples: Returns the samples between two monotonic times, oldest first
+    """
+    def __init__(self, size):
+        self.data = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, monotonic_time, value):
+        """Add a sample"""
+        self.data.append((monotonic_time, value))
+
+    def latest(self):
+        """Returns the most recent sample or None"""
+        try:
+            return self.data[-1]
+        except IndexError:
+            return None
+
+    def samples(self, start=None, end=None):
+        """Returns the samples between two monotonic times, oldest first"""
+        return [sample for sample in self.data.copy()
+                if (start is None or sample[0] >= start) and (end is None or sample[0] <= end)]
+
+
+class GpioSource:
+    """A position switch on an FT232H GPIO pin, the value is 1 while the switch is closed"""
+    kind = 'level'
+    live = True
+    time_scale = 1.0
+
+    def __init__(self, pin):
+        board, digitalio = hardware(pin)
+        self.input = digitalio.DigitalInOut(getattr(board, pin))
+        self.input.direction = digitalio.Direction.INPUT
+
+    def read(self):
+        """Returns the level of the pin"""
+        return 1 if self.input.value else 0
+
+
+class Lis3dhSource:
+    """An LIS3DH accelerometer on the drum on the FT232H I2C bus, the value is the drum angle in degrees"""
+    kind = 'angle'
+    live = True
+    time_scale = 1.0
+
+    def __init__(self):
+        board, _ = hardware()
+        try:
+            import adafruit_lis3dh  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImportError('adafruit-circuitpython-lis3dh is needed for the lis3dh drum sensor') from error
+        self.lis3dh = adafruit_lis3dh.LIS3DH_I2C(board.I2C())
+        self.lis3dh.data_rate = adafruit_lis3dh.DATARATE_400_HZ
+
+    def read(self):
+        """Returns the angle of gravity in the plane of the drum, 0 to 360 degrees"""
+        x_axis, y_axis, _ = self.lis3dh.acceleration
+        return math.degrees(math.atan2(y_axis, x_axis)) % 360
+
+
+class ReplaySource:
+    """A recorded trace file played back with its original timing, compressed by time_scale. Debounce times and
+    speeds are worked out in the recorded time"""
+    live = False
+
+    def __init__(self, path, time_scale=1.0):
+        with open(path, encoding='UTF-8') as trace_file:
+            reader = csv.reader(trace_file)
+            header = next(reader)
+            self.trace = [(float(row[0]), float(row[1])) for row in reader if row]
+        self.kind = header[1]
+        self.path = path
+        self.time_scale = time_scale
+
+    def samples(self, running):
+        """Yields the samples of the trace at their replay times until the trace ends or running is cleared"""
+        if not self.trace:
+            return
+        start = time.monotonic()
+        first = self.trace[0][0]
+        for recorded, value in self.trace:
+            due = start + (recorded - first) / self.time_scale
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if not running():
+                return
+            yield due, value
+
+
+class DrumSensor:
+    """
+    DrumSensor
+
+    Reads a drum position sensor on a thread, keeps the samples in a SensorBuffer and raises a trigger every
+    sensor_rotations_per_segment debounced rotations.
+
+    Methods:
+        subscribe: Register a callback(event) called from the sensor thread on each trigger, it must return quickly
+        start: Start reading the sensor, writing the samples to a trace file
+        stop: Stop reading the sensor
+        status: Returns the rotation count, rotation speed and edge counts
+    """
+    def __init__(self, source, config=None, name=''):
+        self.source = source
+        self.settings = config if config is not None else settings
+        self.name = name
+        self.labels = {'rig': name} if name else {}
+        self.buffer = SensorBuffer(self.settings['sensor_buffer_size'])
+        self.events = deque(maxlen=1000)
+        self.subscribers = []
+        self.output = None
+        self.running = False
+        self.thread = None
+        self.filepath = None
+        self.rotations = 0
+        self.ignored = 0
+        self.last_edge = None
+        self.previous = None
+        self.finished = threading.Event()
+
+    def subscribe(self, callback):
+        """Register a callback(event) called from the sensor thread on each trigger, it must return quickly"""
+        self.subscribers.append(callback)
+
+    def start(self, filepath=None):
+        """Start reading the sensor, a live sensor's samples are written to a trace file"""
+        if self.running:
+            return
+        if self.source.live:
+            if filepath is None:
+                filepath = os.path.join(self.settings['sensor_log_dir'],
+                                        datetime.now().strftime('UCL-Tombola-sensor_%Y-%m-%d_%H-%M-%S.csv'))
+            log_dir = os.path.dirname(filepath)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir)
+        self.filepath = filepath
+        if self.settings['sensor_trigger_output'] and self.output is None:
+            board, digitalio = hardware(self.settings['sensor_trigger_output'])
+            self.output = digitalio.DigitalInOut(getattr(board, self.settings['sensor_trigger_output']))
+            self.output.direction = digitalio.Direction.OUTPUT
+            self.output.value = False
+        self.previous = None
+        self.last_edge = None
+        self.finished.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name='%sdrum-sensor' % (self.name + '-' if self.name else ''),
+                                       daemon=True)
+        self.thread.start()
+        logger.info('DrumSensor: Reading the %s sensor at %s Hz', self.settings['sensor_type'],
+                    self.settings['sensor_sample_rate'])
+
+    def stop(self):
+        """Stop reading the sensor"""
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        logger.info('DrumSensor: Stopped after %s rotations, %s edges ignored', self.rotations, self.ignored)
+
+    def status(self):
+        """Returns the rotation count, the speed measured from the last rotations and the edge counts"""
+        events = list(self.events)
+        periods = [event['period'] for event in events[-10:] if event['period']]
+        return {'running': self.running, 'rotations': self.rotations, 'ignored_edges': self.ignored,
+                'samples': len(self.buffer), 'triggers': len(events),
+                'rpm': (60 * len(periods) * self.settings['sensor_rotations_per_segment']
+                        / (sum(periods) * self.source.time_scale) if periods else None)}
+
+    def __samples(self):
+        """Yields the samples of the source, reading a live sensor on monotonic deadlines"""
+        if not self.source.live:
+            yield from self.source.samples(lambda: self.running)
+            return
+        period = 1 / float(self.settings['sensor_sample_rate'])
+        deadline = time.monotonic()
+        while self.running:
+            value = self.source.read()
+            yield time.monotonic(), value
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                SENSOR_OVERRUNS.inc(**self.labels)
+                deadline = time.monotonic()
+
+    def __run(self):
+        """Read the sensor until stopped or the replayed trace ends"""
+        try:
+            with open(self.filepath, 'a', encoding='UTF-8') if self.filepath else nullcontext() as outfile:
+                if outfile is not None and outfile.tell() == 0:
+                    outfile.write('monotonic,%s\n' % self.source.kind)
+                last_flush = time.monotonic()
+                for timestamp, value in self.__samples():
+                    self.buffer.append(timestamp, value)
+                    if self.__edge(value):
+                        self.__rotation(timestamp, value)
+                    self.previous = value
+                    if outfile is not None:
+                        outfile.write('%.6f,%s\n' % (timestamp, value))
+                        if timestamp - last_flush > 1:
+                            outfile.flush()
+                            last_flush = timestamp
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('DrumSensor: Sensor read failed')
+        finally:
+            self.running = False
+            self.finished.set()
+
+    def __edge(self, value):
+        """Returns True if the drum passed its start position between the previous sample and this one"""
+        if self.previous is None:
+            return False
+        if self.source.kind == 'level':
+            return self.previous < 0.5 <= value
+        turned = (value - self.previous + 180) % 360 - 180
+        if turned > 0:
+            return 0 < (self.settings['sensor_trigger_angle'] - self.previous) % 360 <= turned
+        return 0 < (self.previous - self.settings['sensor_trigger_angle']) % 360 <= -turned
+
+    def __rotation(self, timestamp, value):
+        """Count a debounced rotation edge and raise a trigger every sensor_rotations_per_segment rotations"""
+        scale = self.source.time_scale
+        if self.last_edge is not None and (timestamp - self.last_edge) * scale < self.settings['sensor_debounce_time']:
+            self.ignored += 1
+            SENSOR_EVENTS.inc(outcome='debounced', **self.labels)
+            return
+        period = timestamp - self.last_edge if self.last_edge is not None else None
+        self.last_edge = timestamp
+        self.rotations += 1
+        SENSOR_EVENTS.inc(outcome='rotation', **self.labels)
+        if self.rotations % self.settings['sensor_rotations_per_segment']:
+            return
+        if self.output is not None:
+            self.output.value = True
+            time.sleep(self.settings['sensor_trigger_pulse'])
+            self.output.value = False
+        previous = self.events[-1]['monotonic'] if self.events else None
+        event = {'monotonic': timestamp, 'wall': time.time(), 'rotation': self.rotations, 'value': value,
+                 'period': timestamp - previous if previous is not None else None,
+                 'rpm': 60 / (period * scale) if period else None}
+        self.events.append(event)
+        for callback in self.subscribers:
+            callback(event)
+
+
+def create_sensor(config=None, name='', time_scale=1.0):
+    """Returns a DrumSensor for the sensor_type in the settings"""
+    config = config if config is not None else settings
+    if config['sensor_type'] == 'gpio':
+        source = GpioSource(config['sensor_pin'])
+    elif config['sensor_type'] == 'lis3dh':
+        source = Lis3dhSource()
+    elif config['sensor_type'] == 'replay':
+        source = ReplaySource(config['sensor_replay_file'], time_scale)
+    else:
+        raise ValueError('DrumSensor: Unknown sensor_type %s, use gpio, lis3dh or replay' % config['sensor_type'])
+    return DrumSensor(source, config, name)
+
+
+class TriggeredSwitch:
+    """
+    TriggeredSwitch
+
+    Runs a camera switch on each rotation trigger of the drum sensor. The sensor thread must not block, so each
+    trigger is handed to a single worker thread, and a trigger that arrives while the last switch is still running
+    is skipped.
+
+    Methods:
+        start: Start the sensor, creating it on first use
+        stop: Stop the sensor
+        wait: Wait for a switch that is already running to finish
+        status: Returns the rotation count and speed measured by the sensor, or None before it has started
+    """
+    def __init__(self, switch, config=None, name=''):
+        self.switch = switch
+        self.settings = config if config is not None else settings
+        self.name = name
+        self.labels = {'rig': name} if name else {}
+        self.sensor = None
+        self.executor = None
+        self.future = None
+
+    def start(self):
+        """Start the sensor with the switch subscribed to its rotation triggers"""
+        if self.sensor is None:
+            self.sensor = create_sensor(self.settings, self.name)
+            self.sensor.subscribe(self.__trigger)
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='%scamera-trigger'
+                                               % (self.name + '-' if self.name else ''))
+        self.sensor.start()
+
+    def stop(self):
+        """Stop the sensor"""
+        if self.sensor is not None:
+            self.sensor.stop()
+
+    def wait(self):
+        """Wait for a switch that is already running to finish"""
+        if self.future is not None:
+            wait([self.future])
+
+    def status(self):
+        """Returns the rotation count, the speed measured from the rotations and the edge counts of the sensor"""
+        return self.sensor.status() if self.sensor is not None else None
+
+    def __trigger(self, event):
+        """Hand a rotation trigger to the switch worker, called from the sensor thread so it must not block"""
+        if self.future is not None and not self.future.done():
+            SENSOR_EVENTS.inc(outcome='trigger_skipped', **self.labels)
+            logger.warning('TriggeredSwitch: Rotation trigger %s skipped, the last switch is still running',
+                           event['rotation'])
+            return
+        self.future = self.executor.submit(self.__switch, event)
+
+    def __switch(self, event):
+        """Switch cameras on a rotation trigger"""
+        TRIGGER_LATENCY.observe(time.monotonic() - event['monotonic'], **self.labels)
+        try:
+            self.switch()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('TriggeredSwitch: Camera switch on rotation trigger %s failed', event['rotation'])
+
+
+def write_synthetic_trace(path, rpm, seconds, kind='angle', rate=None, noise=0.0, bounce=0):
+    """Write a trace of a drum turning at rpm, with angle noise in degrees or switch bounces on each closure"""
+    rate = float(rate if rate is not None else settings['sensor_sample_rate'])
+    trace_dir = os.path.dirname(path)
+    if trace_dir and not os.path.exists(trace_dir):
+        os.makedirs(trace_dir)
+    with open(path, 'w', encoding='UTF-8') as outfile:
+        outfile.write('monotonic,%s\n' % kind)
+        closed_at = None
+        for sample in range(int(seconds * rate)):
+            timestamp = sample / rate
+            angle = (timestamp * rpm * 6 + 180) % 360
+            if kind == 'angle':
+                value = round((angle + random.gauss(0, noise)) % 360, 3) if noise else round(angle, 3)
+            else:
+                closed_at = (closed_at if closed_at is not None else sample) if angle < 10 else None
+                bouncing = closed_at is not None and sample - closed_at < 2 * bounce
+                value = int(closed_at is not None and not (bouncing and (sample - closed_at) % 2))
+            outfile.write('%.6f,%s\n' % (timestamp, value))
+
+
+def replay(path, time_scale=1.0):
+    """Replay a trace file through the edge detection and print each trigger, returns the sensor status"""
+    sensor = DrumSensor(ReplaySource(path, time_scale))
+    sensor.subscribe(lambda event: print('Trigger at rotation %s  %s rpm'
+                                         % (event['rotation'], '%.2f' % event['rpm'] if event['rpm'] else '-')))
+    sensor.start()
+    sensor.finished.wait()
+    sensor.stop()
+    return sensor.status()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Record, write and replay UCL-Tombola drum sensor traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record', help='record a trace from the sensor in the settings')
+    record_parser.add_argument('--seconds', type=float, default=60, help='length of the trace')
+    record_parser.add_argument('--output', help='trace file, default a new file in sensor_log_dir')
+    synthetic_parser = commands.add_parser('synthetic', help='write a trace of a drum turning at a set speed')
+    synthetic_parser.add_argument('trace', help='trace file to write')
+    synthetic_parser.add_argument('--rpm', type=float, default=72, help='drum speed')
+    synthetic_parser.add_argument('--seconds', type=float, default=60, help='length of the trace')
+    synthetic_parser.add_argument('--kind', choices=['angle', 'level'], default='angle', help='lis3dh or gpio trace')
+    synthetic_parser.add_argument('--noise', type=float, default=0.0, help='angle noise in degrees')
+    synthetic_parser.add_argument('--bounce', type=int, default=0, help='switch bounces on each closure')
+    replay_parser = commands.add_parser('replay', help='replay a trace and print the triggers')
+    replay_parser.add_argument('trace', help='trace file to replay')
+    replay_parser.add_argument('--time-scale', type=float, default=1.0, help='compress time by this factor')
+    args = parser.parse_args()
+    if args.command == 'record':
+        SENSOR = create_sensor()
+        SENSOR.start(args.output)
+        time.sleep(args.seconds)
+        SENSOR.stop()
+        print('Trace written to %s' % SENSOR.filepath)
+        print(SENSOR.status())
+    elif args.command == 'synthetic':
+        write_synthetic_trace(args.trace, args.rpm, args.seconds, args.kind, noise=args.noise, bounce=args.bounce)
+        print('Trace written to %s' % args.trace)
+    else:
+        print(replay(args.trace, args.time_scale))
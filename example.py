@@ -16,6 +16,7 @@ Available Camera Functions:
     Camera.stop_camera_recording()      Stop the camera recording
     Camera.set_drum_rpm(rpm)            Set the drum rotating at specified RPM
     Camera.get_drum_rpm()               Get the current speed of the drum
+    Camera.ramp_to_rpm(rpm)             Set the drum speed and wait until it has settled
     Camera.change_setting(key, value)   Configure camera settings
     Camera.print_settings_to_console()  Display all current settings
 
@@ -40,7 +41,7 @@ if __name__ == "__main__":
     Camera.start_camera_recording()
     sleep(2)
     print('starting the drum at 95 rpm for 1 minute')
-    Camera.set_drum_rpm(95)
+    Camera.ramp_to_rpm(95)  # wait for the drum to reach speed rather than a fixed time
     sleep(30)
     print('drum is at %s rpm' % Camera.get_drum_rpm())
     sleep(30)
@@ -63,8 +64,7 @@ if __name__ == "__main__":
     Camera.set_drum_rpm(72)
     sleep(10)
     print('slowing the drum to 71.5 rpm')
-    Camera.set_drum_rpm(71.5)
-    sleep(10)
+    Camera.ramp_to_rpm(71.5)
     print('drum is at %s rpm' % Camera.get_drum_rpm())
     sleep(120)
     print('stopping the drum')
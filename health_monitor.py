@@ -0,0 +1,156 @@
+"""
+Health Monitor Module
+
+A background health check of the cameras in the CameraPool.
+
+Every health_check_interval seconds the status endpoint of each camera is probed, all cameras at the
+same time, and the latency and result of the last health_window probes are kept for each camera. A
+camera is up while it answers, degraded when a probe in the window failed or its mean latency is over
+health_degraded_latency, and down after health_down_failures probes in a row have failed. The camera
+pool skips a down camera when choosing the next camera to record. Once a camera that was down answers
+health_recover_probes probes in a row its stale connections are dropped and it is put back into the
+rotation.
+
+Settings used:
+    - camera_status_path: camera API path probed for the health check
+    - health_check_interval: seconds between health checks
+    - health_probe_timeout: timeout of each probe in seconds
+    - health_window: number of probes kept for the latency and failure statistics
+    - health_degraded_latency: mean probe latency in seconds above which a camera is degraded
+    - health_down_failures: probes failed in a row before a camera is down
+    - health_recover_probes: probes answered in a row before a down camera is used again
+
+Usage:
+    from health_monitor import HealthMonitor
+
+    monitor = HealthMonitor(pool, scheduler, on_change)
+    monitor.start()
+    print(monitor.status())
+    monitor.stop()
+"""
+
+import time
+from collections import deque
+import requests
+from app_control import settings
+from logmanager import logger
+from metrics import registry
+
+
+CAMERA_HEALTH = registry.gauge('tombola_camera_health', 'Camera health, 2 up, 1 degraded, 0 down')
+HEALTH_LEVELS = {'up': 2, 'degraded': 1, 'down': 0}
+
+
+class CameraHealth:
+    """The probe results and health state of one camera"""
+    def __init__(self, config):
+        self.settings = config
+        self.results = deque(maxlen=config['health_window'])
+        self.state = 'up'
+        self.failures_in_row = 0
+        self.successes_in_row = 0
+        self.probes = 0
+        self.failures = 0
+
+    def record(self, ok, latency):
+        """Record the result of a probe and return the new health state"""
+        self.results.append((ok, latency))
+        self.probes += 1
+        if ok:
+            self.failures_in_row = 0
+            self.successes_in_row += 1
+        else:
+            self.failures += 1
+            self.failures_in_row += 1
+            self.successes_in_row = 0
+        latencies = [latency for answered, latency in self.results if answered]
+        mean_latency = sum(latencies) / len(latencies) if latencies else None
+        if self.failures_in_row >= self.settings['health_down_failures']:
+            self.state = 'down'
+        elif self.state == 'down' and self.successes_in_row < self.settings['health_recover_probes']:
+            self.state = 'down'
+        elif (not all(answered for answered, _ in self.results)
+              or (mean_latency or 0.0) > self.settings['health_degraded_latency']):
+            self.state = 'degraded'
+        else:
+            self.state = 'up'
+        return self.state
+
+    def summary(self):
+        """Returns the health state with the latency and failure statistics of the window"""
+        latencies = [latency for answered, latency in self.results if answered]
+        return {'state': self.state, 'probes': self.probes, 'failures': self.failures,
+                'window_failure_rate': (sum(1 for answered, _ in self.results if not answered) / len(self.results)
+                                        if self.results else None),
+                'mean_latency': sum(latencies) / len(latencies) if latencies else None,
+                'max_latency': max(latencies) if latencies else None}
+
+
+class HealthMonitor:
+    """
+    HealthMonitor
+
+    Probes the cameras of a CameraPool on a MonotonicScheduler job and keeps the pool up to date.
+
+    Methods:
+        start: Start the health checks
+        stop: Stop the health checks
+        check: Probe all cameras now
+        status: Returns the health state and statistics of each camera
+    """
+    def __init__(self, pool, scheduler, on_change=None, config=None):
+        self.pool = pool
+        self.settings = config if config is not None else settings
+        self.scheduler = scheduler
+        self.on_change = on_change
+        self.job = None
+        self.health = {camera_id: CameraHealth(self.settings) for camera_id in pool.ids()}
+
+    def start(self):
+        """Start the health checks"""
+        if self.job is None:
+            self.job = self.scheduler.call_every(lambda: float(self.settings['health_check_interval']), self.check,
+                                                 name='camera-health')
+
+    def stop(self):
+        """Stop the health checks"""
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def status(self):
+        """Returns the health state and statistics of each camera"""
+        return {camera_id: health.summary() for camera_id, health in self.health.items()}
+
+    def check(self):
+        """Probe all cameras at the same time and update their health"""
+        for camera_id, (ok, latency) in self.pool.fan_out(self.__probe).items():
+            self.__update(camera_id, ok, latency)
+
+    def __probe(self, camera_id):
+        """Probe the status endpoint of a camera, returns (answered, latency)"""
+        start = time.perf_counter()
+        try:
+            response = self.pool[camera_id].session.get(self.settings['camera_status_path'],
+                                                        timeout=self.settings['health_probe_timeout'])
+            return response.status_code == 200, time.perf_counter() - start
+        except requests.RequestException:
+            return False, None
+
+    def __update(self, camera_id, ok, latency):
+        """Record a probe result, update the pool and report a change of state"""
+        health = self.health[camera_id]
+        camera = self.pool[camera_id]
+        previous = health.state
+        state = health.record(ok, latency)
+        camera.state = state
+        CAMERA_HEALTH.set(HEALTH_LEVELS[state], camera=camera_id, **self.pool.labels)
+        if previous == 'down' and state != 'down':
+            camera.session.close()
+            self.pool.mark_ok(camera_id)
+            logger.info('HealthMonitor: Camera %s reconnected', camera_id)
+        if state != previous:
+            log = logger.warning if HEALTH_LEVELS[state] < HEALTH_LEVELS[previous] else logger.info
+            log('HealthMonitor: Camera %s is %s (was %s)', camera_id, state, previous)
+            if self.on_change is not None:
+                self.on_change(camera_id, previous, state)
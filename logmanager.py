@@ -10,9 +10,16 @@ Features:
     - File-based logging with rotation
     - Log level management
     - Thread-safe logging operations
+    - Optional queue-based logging so file I/O and log rotation run on a background listener thread
+    - Optional JSON-lines output with monotonic timestamps
+    - Console output that can be sent through the same queue
+    - Set up on first use, so importing the module creates no files and logs nothing
 
 Exports:
     logger: Configured logger instance for use across the application
+    configure: Use other settings or another log file, before logging starts
+    console: Prints a console message, through the logging queue if console_via_log_queue is set
+    dropped_records: Returns the number of log records dropped because the logging queue was full
 
 Usage:
     from logmanager import logger
@@ -30,18 +37,182 @@ Log Files:
     while maintaining historical records.
 """
 
+import atexit
+import json
 import os
+import queue
 import sys
+import threading
+import time
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from app_control import settings, VERSION
 
-# Ensure log directory exists
-log_dir = os.path.dirname(settings['logfilepath'])
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
 
-logger = logging.getLogger(settings['logappname'])
+class BoundedQueueHandler(QueueHandler):
+    """A QueueHandler that never blocks the caller, when the queue is full records are dropped by the overflow
+    policy: 'drop_new' discards the new record, 'drop_old' discards the oldest queued record"""
+    def __init__(self, log_queue, overflow='drop_new'):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Stamp the record with the monotonic time it was logged"""
+        record.monotonic = time.monotonic()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        """Put the record on the queue without waiting"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'drop_old':
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single JSON line with wall clock and monotonic timestamps"""
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'created': record.created,
+                 'monotonic': getattr(record, 'monotonic', None), 'name': record.name,
+                 'level': record.levelname, 'thread': record.threadName, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class LoggingContext:
+    """
+    LoggingContext
+
+    The application logging, set up the first time it is used rather than when the module is imported.
+
+    Methods:
+        configure: Use other settings or log file before logging starts
+        get_logger: Returns the application logger, setting up logging on first use
+        console: Print a console message, through the logging queue if console_via_log_queue is set
+        dropped_records: Returns the number of log records dropped because the logging queue was full
+        close: Stop the logging queue listener and close the log file
+    """
+    def __init__(self, config=None, logfilepath=None):
+        self.config = config if config is not None else settings
+        self.logfilepath = logfilepath
+        self.logger = None
+        self.console_logger = None
+        self.queue_handler = None
+        self.listener = None
+        self.log_file = None
+        self.handlers = []
+        self.lock = threading.Lock()
+
+    def configure(self, config=None, logfilepath=None):
+        """Use other settings or log file, takes effect when logging starts (or restarts it if already running)"""
+        with self.lock:
+            running = self.logger is not None
+        if running:
+            self.close()
+        self.config = config if config is not None else self.config
+        self.logfilepath = logfilepath if logfilepath is not None else self.logfilepath
+
+    def get_logger(self):
+        """Returns the application logger, setting up logging on first use"""
+        current = self.logger
+        if current is None:
+            with self.lock:
+                if self.logger is None:
+                    self.__setup()
+                current = self.logger
+        return current
+
+    def __setup(self):
+        """Set up the log file, queue and console handlers and log the startup lines"""
+        config = self.config
+        logfilepath = self.logfilepath if self.logfilepath is not None else config['logfilepath']
+        # Ensure log directory exists
+        log_dir = os.path.dirname(logfilepath)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        app_logger = logging.getLogger(config['logappname'])
+        if config['loglevel'].upper() == 'DEBUG':
+            app_logger.setLevel(logging.DEBUG)
+        else:
+            app_logger.setLevel(logging.INFO)
+        log_file = RotatingFileHandler(logfilepath, maxBytes=1048576, backupCount=10)
+        if config['log_json']:
+            log_file.setFormatter(JsonFormatter())
+        else:
+            log_file.setFormatter(logging.Formatter('%(asctime)s, %(name)s, %(levelname)s : %(message)s'))
+        console_logger = logging.getLogger(config['logappname'] + '-console')
+        console_logger.setLevel(logging.INFO)
+        console_logger.propagate = False
+        if config['log_queue']:
+            log_queue = queue.Queue(maxsize=config['log_queue_size'])
+            self.queue_handler = BoundedQueueHandler(log_queue, config['log_overflow'])
+            console_output = logging.StreamHandler(sys.stdout)
+            console_output.addFilter(lambda record: record.name == console_logger.name)
+            log_file.addFilter(lambda record: record.name != console_logger.name)
+            self.listener = QueueListener(log_queue, log_file, console_output)
+            self.listener.start()
+            app_logger.addHandler(self.queue_handler)
+            console_logger.addHandler(self.queue_handler)
+            self.handlers = [(app_logger, self.queue_handler), (console_logger, self.queue_handler)]
+        else:
+            self.queue_handler = None
+            app_logger.addHandler(log_file)
+            self.handlers = [(app_logger, log_file)]
+        self.log_file = log_file
+        self.console_logger = console_logger
+        self.logger = app_logger
+        app_logger.info('Runnng Python %s on %s', sys.version, sys.platform)
+        app_logger.info('Logging level set to: %s', config['loglevel'].upper())
+        app_logger.info('Starting UCL-Tombola-app version %s', VERSION)
+
+    def console(self, message):
+        """Print a message to the console, through the logging queue if console_via_log_queue is set"""
+        self.get_logger()
+        if self.queue_handler is not None and self.config['console_via_log_queue']:
+            self.console_logger.info(message)
+        else:
+            print(message)
+
+    def dropped_records(self):
+        """Returns the number of log records dropped because the logging queue was full"""
+        return self.queue_handler.dropped if self.queue_handler is not None else 0
+
+    def close(self):
+        """Stop the logging queue listener and close the log file"""
+        with self.lock:
+            if self.logger is None:
+                return
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+            for owner, handler in self.handlers:
+                owner.removeHandler(handler)
+            self.log_file.close()
+            self.handlers = []
+            self.queue_handler = None
+            self.logger = None
+
+
+class LazyLogger:
+    """Stands in for the application logger, logging is set up the first time a logger method is used"""
+    def __init__(self, context):
+        self.context = context
+
+    def __getattr__(self, name):
+        return getattr(self.context.get_logger(), name)
+
+
+logging_context = LoggingContext()
+atexit.register(logging_context.close)
+
+logger = LazyLogger(logging_context)
 """
 Usage:\n
 **logger.info('message')** for info messages\n
@@ -49,17 +220,17 @@ Usage:\n
 **logger.error('message')** for errors
 """
 
-if settings['loglevel'].upper() == 'DEBUG':
-    logger.setLevel(logging.DEBUG)
-else:
-    logger.setLevel(logging.INFO)
 
+def configure(config=None, logfilepath=None):
+    """Use other settings or another log file than the logfilepath setting, call before logging starts"""
+    logging_context.configure(config, logfilepath)
+
+
+def console(message):
+    """Print a message to the console, through the logging queue if console_via_log_queue is set"""
+    logging_context.console(message)
 
 
-LogFile = RotatingFileHandler(settings['logfilepath'], maxBytes=1048576, backupCount=10)
-formatter = logging.Formatter('%(asctime)s, %(name)s, %(levelname)s : %(message)s')
-LogFile.setFormatter(formatter)
-logger.addHandler(LogFile)
-logger.info('Runnng Python %s on %s', sys.version, sys.platform)
-logger.info('Logging level set to: %s',settings['loglevel'].upper())
-logger.info('Starting UCL-Tombola-app version %s', VERSION)
+def dropped_records():
+    """Returns the number of log records dropped because the logging queue was full"""
+    return logging_context.dropped_records()
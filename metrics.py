@@ -0,0 +1,236 @@
+"""
+Metrics Module
+
+Prometheus-style instrumentation of the camera and drum operations.
+
+Latency histograms and error and timeout counters are kept for every endpoint of each camera and the
+drum controller, along with gauges for the camera switch overlap, cadence lateness and save backlog.
+They are served in the Prometheus text format on a local HTTP endpoint and can be printed as a summary
+at the end of a run, so a degrading camera link or a slow SSD shows up before it costs an experiment.
+
+Settings used:
+    - metrics_port: port of the local metrics endpoint, 0 to turn it off
+
+Usage:
+    from metrics import registry, start_server
+
+    start_server()
+    registry.histogram('tombola_request_seconds', 'Request latency').observe(0.012, endpoint='camera1')
+    registry.counter('tombola_request_errors_total', 'Failed requests').inc(endpoint='camera1')
+    print(registry.summary())
+
+    curl http://127.0.0.1:9105/metrics
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app_control import settings
+from logmanager import logger
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def label_key(labels):
+    """Returns the key for a dictionary of labels, values are kept as text so keys always sort"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def label_text(labels):
+    """Returns the Prometheus label text for a tuple of (name, value) pairs"""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in labels)
+
+
+class Metric:
+    """Base class for a metric with a value for each combination of labels"""
+    kind = 'untyped'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def exposition(self):
+        """Returns the metric in the Prometheus text format"""
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name, label_text(labels), value))
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add to the counter"""
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge"""
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Counts of observations in cumulative buckets with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Record an observation"""
+        key = label_key(labels)
+        with self.lock:
+            counts, total, count, maximum = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0, 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, count + 1, max(maximum, value))
+
+    def exposition(self):
+        """Returns the histogram in the Prometheus text format"""
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            for labels, (counts, total, count, _) in sorted(self.values.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket%s %s' % (self.name, label_text(labels + (('le', bucket),)), cumulative))
+                lines.append('%s_sum%s %s' % (self.name, label_text(labels), total))
+                lines.append('%s_count%s %s' % (self.name, label_text(labels), count))
+        return lines
+
+    def quantile(self, quantile, **labels):
+        """Returns an estimate of a quantile from the bucket upper bounds"""
+        key = label_key(labels)
+        with self.lock:
+            if key not in self.values:
+                return None
+            counts, _, count, maximum = self.values[key]
+        target = quantile * count
+        cumulative = 0
+        for bucket, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(bucket, maximum)
+        return maximum
+
+
+class Registry:
+    """
+    Registry
+
+    The collection of metrics, each created on first use.
+
+    Methods:
+        counter: Returns the named counter
+        gauge: Returns the named gauge
+        histogram: Returns the named histogram
+        exposition: Returns all metrics in the Prometheus text format
+        summary: Returns a readable summary for the end of a run
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __get(self, metric_class, name, description):
+        """Returns the named metric, creating it if needed"""
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, description)
+            return self.metrics[name]
+
+    def counter(self, name, description=''):
+        """Returns the named counter"""
+        return self.__get(Counter, name, description)
+
+    def gauge(self, name, description=''):
+        """Returns the named gauge"""
+        return self.__get(Gauge, name, description)
+
+    def histogram(self, name, description=''):
+        """Returns the named histogram"""
+        return self.__get(Histogram, name, description)
+
+    def exposition(self):
+        """Returns all metrics in the Prometheus text format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Returns a readable summary of the metrics for the end of a run"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = ['UCL-Tombola-app run metrics:']
+        for metric in metrics:
+            with metric.lock:
+                items = sorted(metric.values.items())
+            for labels, value in items:
+                name = metric.name + label_text(labels)
+                if isinstance(metric, Histogram):
+                    _, total, count, maximum = value
+                    lines.append('%-70s count %6s  mean %8.2f ms  p95 %8.2f ms  max %8.2f ms'
+                                 % (name, count, total / count * 1000, metric.quantile(0.95, **dict(labels)) * 1000,
+                                    maximum * 1000))
+                else:
+                    lines.append('%-70s %s' % (name, value))
+        return '\n'.join(lines)
+
+
+registry = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics on /metrics"""
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request"""
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        data = registry.exposition().encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the metrics server out of the log"""
+
+
+server = None
+
+
+def start_server(port=None):
+    """Start the local metrics endpoint once, returns the server or None if it is turned off or cannot start"""
+    global server  # pylint: disable=global-statement
+    port = settings['metrics_port'] if port is None else port
+    if server is not None or not port:
+        return server
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    except OSError as error:
+        logger.warning('Metrics: Could not start the metrics endpoint on port %s: %s', port, error)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info('Metrics: Serving metrics on http://127.0.0.1:%s/metrics', port)
+    return server
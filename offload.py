@@ -0,0 +1,198 @@
+"""
+Offload Module
+
+Post-run offload of the saved segments from the camera storage to the collection PC.
+
+The segments the recording index marks as saved are fetched from the camera storage (mounted on the
+collection PC, one mount per camera), checked and optionally transcoded or split into frames, using a
+process pool sized to the available cores so the PC can process one run while the next is recording.
+Each segment is copied and its SHA-256 checked against the copy, video files are checked with ffprobe
+when it is installed, and the offload_command (if set) is run on the copy with {source} and {output}
+replaced by the copied file and the output path without an extension. Segments are handled in the
+order they finish and each result is written to a JSON manifest, so an interrupted offload carries on
+where it stopped and failed segments are retried on the next run.
+
+Settings used:
+    - offload_mounts: local paths where the camera_storage of each camera is mounted, in camera order
+    - offload_dir: directory the segments are copied to, with a sub-directory for each camera
+    - offload_manifest: path of the JSON manifest of offloaded segments
+    - offload_workers: number of worker processes, 0 for one per core
+    - offload_command: command run on each copied segment, for example
+      ["ffmpeg", "-v", "error", "-i", "{source}", "-c:v", "libx265", "{output}.mp4"], [] to only copy
+    - offload_poll_interval: seconds between checks of the recording index when watching
+
+Usage:
+    python offload.py               offload the segments saved so far
+    python offload.py --watch       keep offloading new segments as they are saved until stopped with Ctrl-C
+
+    from offload import OffloadPipeline
+
+    OffloadPipeline().run()
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import escape, glob
+from app_control import settings
+from logmanager import logger
+from recording_index import RecordingIndex
+
+
+def file_hash(path):
+    """Returns the SHA-256 of a file, or of the files in a directory in name order"""
+    digest = hashlib.sha256()
+    paths = sorted(glob(os.path.join(path, '**', '*'), recursive=True)) if os.path.isdir(path) else [path]
+    for filepath in paths:
+        if os.path.isfile(filepath):
+            with open(filepath, 'rb') as infile:
+                for block in iter(functools.partial(infile.read, 1048576), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def process_segment(source, destination, command):
+    """Copy a segment, verify the copy and run the command on it, runs in a worker process"""
+    start = time.monotonic()
+    result = {'source': source, 'copy': destination, 'status': 'failed', 'error': None}
+    try:
+        source_hash = file_hash(source)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.isdir(source):
+            shutil.copytree(source, destination, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(source, destination)
+        result['sha256'] = file_hash(destination)
+        if result['sha256'] != source_hash:
+            raise IOError('copy does not match the source')
+        if os.path.isfile(destination) and shutil.which('ffprobe'):
+            probe = subprocess.run(['ffprobe', '-v', 'error', destination], capture_output=True, text=True,
+                                   check=False)
+            if probe.returncode != 0:
+                raise IOError('ffprobe: %s' % probe.stderr.strip())
+        if command:
+            output = os.path.splitext(destination)[0]
+            arguments = [argument.format(source=destination, output=output) for argument in command]
+            run = subprocess.run(arguments, capture_output=True, text=True, check=False)
+            if run.returncode != 0:
+                raise IOError('%s: %s' % (command[0], run.stderr.strip()))
+            result['output'] = output
+        result['status'] = 'done'
+    except (OSError, ValueError) as error:
+        result['error'] = str(error)
+    result['seconds'] = time.monotonic() - start
+    return result
+
+
+class OffloadPipeline:
+    """
+    OffloadPipeline
+
+    Offloads the saved segments listed in the recording index in parallel worker processes.
+
+    Methods:
+        pending: Returns the saved segments not yet offloaded
+        run: Offload the pending segments, with watch=True keep going until stopped
+        stop: Stop watching for new segments
+    """
+    def __init__(self, index=None, manifest_path=None, workers=None):
+        self.index = index if index is not None else RecordingIndex()
+        self.manifest_path = manifest_path if manifest_path is not None else settings['offload_manifest']
+        self.workers = workers if workers else (settings['offload_workers'] or os.cpu_count() or 1)
+        self.manifest = self.__read_manifest()
+        self.stopped = threading.Event()
+
+    def __read_manifest(self):
+        """Read the manifest of offloaded segments, an empty manifest if there is none"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='UTF-8') as infile:
+            return json.load(infile)
+
+    def __write_manifest(self):
+        """Write the manifest atomically, via a temporary file renamed over the manifest"""
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        temporary = self.manifest_path + '.tmp'
+        with open(temporary, 'w', encoding='UTF-8') as outfile:
+            json.dump(self.manifest, outfile, indent=4, sort_keys=True)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temporary, self.manifest_path)
+
+    @staticmethod
+    def __source(segment):
+        """Returns the path of a segment on its camera's mounted storage, or None if it cannot be found"""
+        mounts = settings['offload_mounts']
+        if segment['camera'] > len(mounts):
+            return None
+        matches = sorted(glob(os.path.join(escape(mounts[segment['camera'] - 1]),
+                                           escape(segment['filename']) + '*')))
+        return matches[0] if matches else None
+
+    def pending(self):
+        """Returns the saved segments not yet offloaded, oldest first"""
+        return [segment for segment in self.index.find_by_time(0.0, float('inf'))
+                if segment['save_status'] == 'completed'
+                and self.manifest.get(segment['filename'], {}).get('status') != 'done']
+
+    def stop(self):
+        """Stop watching for new segments"""
+        self.stopped.set()
+
+    def run(self, watch=False):
+        """Offload the pending segments in order of completion, returns the number offloaded"""
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while not self.stopped.is_set():
+                done += self.__offload(executor, self.pending())
+                if not watch or self.stopped.wait(settings['offload_poll_interval']):
+                    break
+        return done
+
+    def __offload(self, executor, segments):
+        """Submit segments to the worker processes and record each result as it finishes"""
+        futures = {}
+        for segment in segments:
+            source = self.__source(segment)
+            if source is None:
+                logger.warning('Offload: Segment %s not found on the camera %s storage', segment['filename'],
+                               segment['camera'])
+                continue
+            destination = os.path.join(settings['offload_dir'], 'cam%s' % segment['camera'], os.path.basename(source))
+            futures[executor.submit(process_segment, source, destination, settings['offload_command'])] = segment
+        if futures:
+            logger.info('Offload: Offloading %s segments with %s workers', len(futures), self.workers)
+        done = 0
+        for future in as_completed(futures):
+            segment = futures[future]
+            result = future.result()
+            result['camera'] = segment['camera']
+            self.manifest[segment['filename']] = result
+            self.__write_manifest()
+            if result['status'] == 'done':
+                done += 1
+                logger.info('Offload: %s offloaded in %.1f s', segment['filename'], result['seconds'])
+            else:
+                logger.error('Offload: %s failed: %s', segment['filename'], result['error'])
+        return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offload the saved UCL-Tombola segments from the cameras')
+    parser.add_argument('--watch', action='store_true', help='keep offloading new segments until stopped')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+    PIPELINE = OffloadPipeline(workers=args.workers)
+    try:
+        print('Offloaded %s segments' % PIPELINE.run(args.watch))
+    except KeyboardInterrupt:
+        PIPELINE.stop()
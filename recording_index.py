@@ -0,0 +1,148 @@
+"""
+Recording Index Module
+
+An SQLite catalogue of every segment recorded and saved by the cameras.
+
+Each segment is stored with the camera id, the monotonic and wall clock start and stop times, the
+frame period and estimated frame count, the requested and measured drum speed and the status of the
+file save, so the segments covering a time range or a drum speed can be found without searching logs.
+
+Settings used:
+    - recording_index_path: path of the SQLite database file
+
+Usage:
+    from recording_index import RecordingIndex
+
+    index = RecordingIndex()
+    segment = open_segment(camera_id, requested_rpm=72)
+    ...
+    segment_id = index.add_segment(close_segment(segment, 1000, 'tombola1'))
+    index.set_save_status(segment['filename'], 'completed')
+    index.find_by_rpm(70, 75)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from app_control import settings
+
+
+SAVE_STATUSES = ('queued', 'completed', 'failed', 'not_saved')
+SEGMENT_FIELDS = ('filename', 'camera', 'start_monotonic', 'stop_monotonic', 'start_wall', 'stop_wall', 'frame_period',
+                  'frame_count', 'requested_rpm', 'measured_rpm', 'save_status')
+
+
+def segment_filename(camera_id, name=''):
+    """Returns the file name for a segment stopping now, with the rig name if there is one"""
+    return (datetime.now().strftime('UCL-Tombola_%Y-%m-%d_%H-%M-%S-%f')[:-3]
+            + '_%scam%s' % (name + '_' if name else '', camera_id))
+
+
+def segment_frames(start_monotonic, stop_monotonic, frame_rate, max_frames=None):
+    """Returns the frame period in nanoseconds and the estimated frame count of a segment"""
+    frame_count = int((stop_monotonic - start_monotonic) * frame_rate)
+    if max_frames:
+        frame_count = min(frame_count, max_frames)
+    return int(round(1000000000 / frame_rate)), frame_count
+
+
+def open_segment(camera_id, requested_rpm=None):
+    """Returns the record of a segment starting now on a camera, completed by close_segment when it stops"""
+    return {'camera': camera_id, 'start_monotonic': time.monotonic(), 'start_wall': time.time(),
+            'requested_rpm': requested_rpm}
+
+
+def close_segment(segment, frame_rate, name='', max_frames=None):
+    """Completes the record of a segment stopping now with its file name, stop times, frame period and frame count"""
+    segment.update(filename=segment_filename(segment['camera'], name), stop_monotonic=time.monotonic(),
+                   stop_wall=time.time())
+    segment['frame_period'], segment['frame_count'] = segment_frames(segment['start_monotonic'],
+                                                                     segment['stop_monotonic'], frame_rate, max_frames)
+    return segment
+
+
+class RecordingIndex:
+    """
+    RecordingIndex
+
+    A thread safe SQLite catalogue of recorded segments.
+
+    Methods:
+        add_segment: Add a recorded segment, returns its id
+        set_save_status: Update the save status of a segment
+        find_by_time: Returns the segments overlapping a wall clock time range
+        find_by_rpm: Returns the segments with a measured (or requested) speed in a range
+        close: Close the database
+    """
+    def __init__(self, filepath=None):
+        self.filepath = filepath if filepath is not None else settings['recording_index_path']
+        index_dir = os.path.dirname(self.filepath)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.filepath, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS segments ('
+                                    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                    'filename TEXT UNIQUE NOT NULL, '
+                                    'camera INTEGER NOT NULL, '
+                                    'start_monotonic REAL, stop_monotonic REAL, '
+                                    'start_wall REAL, stop_wall REAL, '
+                                    'frame_period INTEGER, frame_count INTEGER, '
+                                    'requested_rpm REAL, measured_rpm REAL, '
+                                    'save_status TEXT NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS segments_time ON segments (start_wall, stop_wall)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS segments_rpm ON segments (measured_rpm)')
+
+    def add_segment(self, segment):
+        """Add a recorded segment, a dictionary of SEGMENT_FIELDS where the frame, speed and save status fields can
+        be left out, returns its id"""
+        unknown = set(segment) - set(SEGMENT_FIELDS)
+        if unknown:
+            raise ValueError('Unknown segment fields %s' % ', '.join(sorted(unknown)))
+        values = dict.fromkeys(SEGMENT_FIELDS)
+        values['save_status'] = 'queued'
+        values.update(segment)
+        with self.lock, self.connection:
+            cursor = self.connection.execute('INSERT INTO segments (%s) VALUES (%s)'
+                                             % (', '.join(SEGMENT_FIELDS), ', '.join('?' * len(SEGMENT_FIELDS))),
+                                             [values[field] for field in SEGMENT_FIELDS])
+            return cursor.lastrowid
+
+    def set_save_status(self, filename, status):
+        """Update the save status of a segment"""
+        if status not in SAVE_STATUSES:
+            raise ValueError('Unknown save status %s' % status)
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE segments SET save_status = ? WHERE filename = ?', (status, filename))
+
+    def find_by_time(self, start_wall, end_wall, camera_id=None):
+        """Returns the segments overlapping a wall clock (time.time()) range, oldest first"""
+        query = 'SELECT * FROM segments WHERE stop_wall >= ? AND start_wall <= ?'
+        parameters = [start_wall, end_wall]
+        if camera_id is not None:
+            query += ' AND camera = ?'
+            parameters.append(camera_id)
+        return self.__query(query + ' ORDER BY start_wall', parameters)
+
+    def find_by_rpm(self, minimum, maximum, status=None):
+        """Returns the segments with a measured speed (or requested speed if not measured) in a range"""
+        query = 'SELECT * FROM segments WHERE COALESCE(measured_rpm, requested_rpm) BETWEEN ? AND ?'
+        parameters = [minimum, maximum]
+        if status is not None:
+            query += ' AND save_status = ?'
+            parameters.append(status)
+        return self.__query(query + ' ORDER BY start_wall', parameters)
+
+    def close(self):
+        """Close the database"""
+        with self.lock:
+            self.connection.close()
+
+    def __query(self, query, parameters):
+        """Run a select query and return the rows as dictionaries"""
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(query, parameters).fetchall()]
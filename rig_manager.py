@@ -0,0 +1,181 @@
+"""
+Rig Manager Module
+
+Runs several UCL Tombola rigs, each a drum with its own cameras, from one process.
+
+Each rig is a CameraClass with its own settings json file, so each has its own cameras, drum controller,
+cadence and recording index. A rig whose recording index, rpm log or sensor log path is left at the default
+keeps them under the directory of its settings file (for this run only, the settings file is not changed),
+and segment filenames include the rig name. All rigs share one MonotonicScheduler thread and one thread
+pool for the camera calls, so adding a rig adds no timer threads. Recording and sequences are started on
+the rigs at a common time.monotonic() start time and each rig's camera switches are anchored to it, so rigs
+with the same cadence switch their cameras at the same moments.
+
+Rig file format:
+    {"rigs": {"tombola1": {"settings": "rigs/tombola1/settings.json", "sequence": "example_sequence.json"},
+              "tombola2": {"settings": "rigs/tombola2/settings.json", "sequence": "example_sequence.json"}}}
+
+Settings used:
+    - rig_start_delay: seconds from asking the rigs to start to their common start time
+    - rig_pool_workers: threads in the pool shared by the camera calls of all rigs
+    - sequence_log_dir: directory for the timing log of each rig's sequence
+
+Usage:
+    python rig_manager.py rigs.json
+    python rig_manager.py rigs.json --dry-run --time-scale 60
+
+    from rig_manager import RigManager
+
+    manager = RigManager()
+    manager.add_rig('tombola1', 'rigs/tombola1/settings.json')
+    manager.add_rig('tombola2', 'rigs/tombola2/settings.json')
+    manager.start_recording()
+    manager['tombola1'].set_drum_rpm(72)
+    manager.stop_recording()
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app_control import SettingsStore, initialise, settings
+from camera_timed import CameraClass
+from logmanager import logger
+from scheduler import MonotonicScheduler
+from sequence_runner import SequenceRunner, load_schedule
+
+
+RIG_PATHS = ('recording_index_path', 'rpm_log_dir', 'sensor_log_dir')
+
+
+class RigManager:
+    """
+    RigManager
+
+    A set of named rigs sharing one scheduler and one thread pool.
+
+    Methods:
+        add_rig: Add a rig with its own settings file, returns its CameraClass
+        start_recording: Start recording on the rigs at a common start time
+        stop_recording: Stop recording on the rigs
+        run_sequences: Run a schedule on each rig from a common start time
+        status: Returns the recording camera, switch timing and camera health of each rig
+        close: Stop the scheduler and the shared thread pool
+    """
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler if scheduler is not None else MonotonicScheduler('rig-scheduler')
+        self.executor = ThreadPoolExecutor(max_workers=settings['rig_pool_workers'], thread_name_prefix='rig-pool')
+        self.rigs = {}
+
+    def __getitem__(self, name):
+        return self.rigs[name]
+
+    def __len__(self):
+        return len(self.rigs)
+
+    def add_rig(self, name, settings_path=None, config=None):
+        """Add a rig using a settings json file (or a SettingsStore), returns its CameraClass"""
+        if name in self.rigs:
+            raise ValueError('Rig %s has already been added' % name)
+        if config is None and settings_path is None:
+            raise ValueError('Rig %s needs a settings file' % name)
+        config = config if config is not None else SettingsStore(path=settings_path)
+        self.__rig_paths(name, config)
+        self.rigs[name] = CameraClass(self.scheduler, config, self.executor, name)
+        logger.info('RigManager: Added rig %s with %s cameras', name, len(self.rigs[name].cameras))
+        return self.rigs[name]
+
+    def __rig_paths(self, name, config):
+        """Move the rig's default data paths under its settings directory and check no other rig uses them"""
+        defaults = initialise()
+        rig_dir = os.path.dirname(os.path.abspath(config.path))
+        config.update({key: os.path.join(rig_dir, os.path.normpath(defaults[key])) for key in RIG_PATHS
+                       if config[key] == defaults[key]}, persist=False)
+        for other_name, other in self.rigs.items():
+            for key in RIG_PATHS:
+                if os.path.abspath(other.settings[key]) == os.path.abspath(config[key]):
+                    raise ValueError('Rig %s has the same %s as rig %s: %s' % (name, key, other_name, config[key]))
+
+    def __names(self, names):
+        """Returns the rig names to act on, all rigs if names is None"""
+        return list(self.rigs) if names is None else list(names)
+
+    def __start_time(self, delay):
+        """Returns the common start time for the rigs"""
+        return time.monotonic() + (settings['rig_start_delay'] if delay is None else delay)
+
+    def start_recording(self, names=None, delay=None):
+        """Start recording on the rigs at a common start time with their switches anchored to it, returns the start"""
+        start = self.__start_time(delay)
+        time.sleep(max(0.0, start - time.monotonic()))
+        self.__on_rigs('start_camera_recording', self.__names(names), start)
+        logger.info('RigManager: Recording started on %s', ', '.join(self.__names(names)))
+        return start
+
+    def stop_recording(self, names=None):
+        """Stop recording on the rigs at the same time"""
+        self.__on_rigs('stop_camera_recording', self.__names(names))
+        logger.info('RigManager: Recording stopped on %s', ', '.join(self.__names(names)))
+
+    def __on_rigs(self, method, names, *arguments):
+        """Call a method of each rig on a thread of its own and wait for them all. The rigs' camera calls use the
+        shared thread pool and wait on it, so the rig calls must not take workers from that pool"""
+        threads = [threading.Thread(target=getattr(self.rigs[name], method), args=arguments,
+                                    name='%s-%s' % (name, method), daemon=True) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_sequences(self, schedules, dry_run=False, time_scale=1.0, delay=None):
+        """Run a schedule on each rig (a dictionary of rig name and schedule) from a common start time,
+        returns a dictionary of rig name and timing records"""
+        start = self.__start_time(delay)
+        stamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        runners = {name: SequenceRunner(self.rigs[name], schedule, dry_run, time_scale)
+                   for name, schedule in schedules.items()}
+        results = {}
+        threads = []
+        for name, runner in runners.items():
+            logfile = os.path.join(settings['sequence_log_dir'], 'sequence_%s_%s.csv' % (name, stamp))
+            thread = threading.Thread(target=self.__run_sequence, args=(runner, logfile, start, results, name),
+                                      name='%s-sequence' % name, daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def __run_sequence(runner, logfile, start, results, name):
+        """Run one rig's sequence and keep its timing records"""
+        results[name] = runner.run(logfile, start)
+
+    def status(self):
+        """Returns the recording camera, switch timing and camera health of each rig"""
+        return {name: {'running': rig.running, 'camera': rig.camera_no, 'switch_timing': rig.switch_timing(),
+                       'health': rig.camera_health()} for name, rig in self.rigs.items()}
+
+    def close(self):
+        """Stop the scheduler and the shared thread pool"""
+        self.scheduler.stop()
+        self.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run experiment sequences on several UCL-Tombola rigs together')
+    parser.add_argument('rigs', help='JSON rig file')
+    parser.add_argument('--dry-run', action='store_true', help='run without calling the cameras or drums')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='compress time by this factor')
+    args = parser.parse_args()
+    with open(args.rigs, encoding='UTF-8') as rig_file:
+        RIGS = json.load(rig_file)['rigs']
+    MANAGER = RigManager()
+    for RIG_NAME, RIG in RIGS.items():
+        MANAGER.add_rig(RIG_NAME, RIG['settings'])
+    MANAGER.run_sequences({name: load_schedule(rig['sequence']) for name, rig in RIGS.items()},
+                          args.dry_run, args.time_scale)
+    MANAGER.close()
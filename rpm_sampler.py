@@ -0,0 +1,177 @@
+"""
+RPM Sampler Module
+
+A background sampler of the drum speed from the UCL Tombola Controller API.
+
+The sampler polls the drum controller at a fixed rate over the pooled keep-alive drum session and stores
+each sample in a fixed-size ring buffer backed by arrays of doubles, so the latest speed can be read from
+memory without a network round-trip. Every sample is also streamed to a file for the run, either as csv
+text or as packed little-endian doubles (monotonic time, wall clock time, rpm) for a compact time series.
+
+Settings used:
+    - rpm_sample_rate: samples per second
+    - rpm_buffer_size: number of samples held in memory
+    - rpm_log_dir: directory for the per-run sample files
+    - rpm_log_format: csv or bin
+
+Usage:
+    from rpm_sampler import RpmSampler
+
+    sampler = RpmSampler(drum_session)
+    sampler.start()
+    monotonic_time, wall_time, rpm = sampler.buffer.latest()
+    sampler.stop()
+"""
+
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+import requests
+from app_control import settings
+from logmanager import logger
+
+
+SAMPLE_FORMAT = struct.Struct('<ddd')
+
+
+class RingBuffer:
+    """
+    RingBuffer
+
+    A fixed-size buffer of (monotonic time, wall clock time, rpm) samples backed by arrays of doubles.
+    Once full, each new sample overwrites the oldest one.
+
+    Methods:
+        append: Add a sample
+        latest: Returns the most recent sample or None
+        samples: Returns the samples between two monotonic times, oldest first
+    """
+    def __init__(self, size):
+        self.size = size
+        self.monotonic = array('d', bytes(8 * size))
+        self.wall = array('d', bytes(8 * size))
+        self.rpm = array('d', bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, monotonic_time, wall_time, rpm):
+        """Add a sample"""
+        with self.lock:
+            self.monotonic[self.index] = monotonic_time
+            self.wall[self.index] = wall_time
+            self.rpm[self.index] = rpm
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def latest(self):
+        """Returns the most recent sample or None"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            last = (self.index - 1) % self.size
+            return self.monotonic[last], self.wall[last], self.rpm[last]
+
+    def samples(self, start=None, end=None):
+        """Returns the samples between two monotonic times, oldest first"""
+        with self.lock:
+            first = (self.index - self.count) % self.size
+            ordered = [((first + offset) % self.size) for offset in range(self.count)]
+            result = [(self.monotonic[i], self.wall[i], self.rpm[i]) for i in ordered]
+        return [sample for sample in result
+                if (start is None or sample[0] >= start) and (end is None or sample[0] <= end)]
+
+
+class RpmSampler:
+    """
+    RpmSampler
+
+    Polls the drum speed at a fixed rate on monotonic deadlines and records it in a RingBuffer and a run file.
+
+    Methods:
+        start: Start sampling to a new run file
+        stop: Stop sampling and close the run file
+        fresh_sample: Returns the latest sample if it is recent, None if sampling has stopped or fallen behind
+    """
+    def __init__(self, drum_session, rate=None, buffer_size=None, config=None):
+        self.session = drum_session
+        self.settings = config if config is not None else settings
+        self.rate = float(rate if rate is not None else self.settings['rpm_sample_rate'])
+        self.buffer = RingBuffer(buffer_size if buffer_size is not None else self.settings['rpm_buffer_size'])
+        self.running = False
+        self.errors = 0
+        self.filepath = None
+        self.thread = None
+
+    def start(self, filepath=None):
+        """Start sampling to a new run file"""
+        if self.running:
+            return
+        if filepath is None:
+            extension = 'bin' if self.settings['rpm_log_format'] == 'bin' else 'csv'
+            filepath = os.path.join(self.settings['rpm_log_dir'],
+                                    datetime.now().strftime('UCL-Tombola-rpm_%Y-%m-%d_%H-%M-%S.') + extension)
+        log_dir = os.path.dirname(filepath)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self.filepath = filepath
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name='rpm-sampler', daemon=True)
+        self.thread.start()
+        logger.info('RpmSampler: Sampling drum speed at %s Hz to %s', self.rate, filepath)
+
+    def stop(self):
+        """Stop sampling and close the run file"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        logger.info('RpmSampler: Sampling stopped, %s read errors', self.errors)
+
+    def fresh_sample(self, max_periods=3):
+        """Returns the latest sample while sampling, None if it is older than max_periods sample periods"""
+        if not self.running:
+            return None
+        sample = self.buffer.latest()
+        if sample is None or time.monotonic() - sample[0] > max_periods / self.rate:
+            return None
+        return sample
+
+    def __read(self):
+        """Read the drum speed, returns None if the request fails"""
+        try:
+            response = self.session.post(json={'rpm': True})
+            return float(response.json()['rpm'])
+        except (requests.RequestException, ValueError, KeyError):
+            self.errors += 1
+            return None
+
+    def __run(self):
+        """Sample on monotonic deadlines until stopped"""
+        binary = self.filepath.endswith('.bin')
+        period = 1 / self.rate
+        with open(self.filepath, 'ab' if binary else 'a', encoding=None if binary else 'UTF-8') as outfile:
+            if not binary and outfile.tell() == 0:
+                outfile.write('monotonic,wall,rpm\n')
+            deadline = time.monotonic()
+            last_flush = deadline
+            while self.running:
+                rpm = self.__read()
+                if rpm is not None:
+                    sample = (time.monotonic(), time.time(), rpm)
+                    self.buffer.append(*sample)
+                    if binary:
+                        outfile.write(SAMPLE_FORMAT.pack(*sample))
+                    else:
+                        outfile.write('%.6f,%.6f,%s\n' % sample)
+                if time.monotonic() - last_flush > 1:
+                    outfile.flush()
+                    last_flush = time.monotonic()
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
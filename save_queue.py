@@ -0,0 +1,167 @@
+"""
+Save Queue Module
+
+A background file-save pipeline for the Chronos cameras.
+
+Each camera has a FileSaveQueue with a bounded queue of file names and a worker thread. The worker
+sends the startFilesave API call for each file then polls the camera state until the save has
+finished, so recording control never waits on a save and the switch logic can ask whether a camera
+is free before starting it again. Save throughput and backlog are kept for each camera.
+
+Settings used:
+    - save_queue_size: maximum number of saves waiting per camera
+    - camera_status_path: camera API path returning the camera state
+    - camera_save_poll_interval: seconds between polls of the camera state while saving
+    - camera_save_timeout: seconds after which a save is treated as failed
+
+Usage:
+    from save_queue import FileSaveQueue
+
+    queue = FileSaveQueue(1, session, start_save)
+    queue.submit('UCL-Tombola_2025-01-01_12-00-00')
+    save_in_progress({'state': 'saving'})      True while the camera state reports a save
+"""
+
+import queue
+import threading
+import time
+import requests
+from app_control import settings
+from logmanager import logger
+from metrics import registry
+
+
+SAVE_BACKLOG = registry.gauge('tombola_save_backlog', 'File saves queued or in progress on each camera')
+SAVE_SECONDS = registry.histogram('tombola_save_seconds', 'Time taken by each camera file save')
+SAVE_FAILURES = registry.counter('tombola_save_failures_total', 'Camera file saves that failed or timed out')
+
+
+def save_in_progress(status):
+    """Returns True if a camera state (the json body of camera_status_path) reports a file save in progress"""
+    if isinstance(status, dict):
+        status = status.get('state', status.get('status', ''))
+    status = str(status).lower()
+    return 'save' in status or 'saving' in status
+
+
+class FileSaveQueue:
+    """
+    FileSaveQueue
+
+    A bounded queue of file saves for one camera, worked by a background thread.
+    start_save(camera_id, filename) sends the startFilesave API call and returns True if the camera accepted it,
+    the optional on_complete(camera_id, filename, saved) is called when each save finishes or fails.
+
+    Methods:
+        submit: Queue a file save, returns False if the queue is full
+        busy: Returns True while a save is queued or in progress
+        wait: Wait for all queued saves to finish
+        metrics: Returns the save throughput (saves per minute and frames per second) and backlog
+    """
+    def __init__(self, camera_id, session, start_save, on_complete=None, config=None, labels=None):
+        self.settings = config if config is not None else settings
+        self.camera_id = camera_id
+        self.labels = dict(labels or {}, camera=camera_id)
+        self.session = session
+        self.start_save = start_save
+        self.on_complete = on_complete
+        self.queue = queue.Queue(maxsize=self.settings['save_queue_size'])
+        self.active = None
+        self.completed = 0
+        self.failed = 0
+        self.save_seconds = 0.0
+        self.frames_saved = 0
+        self.frame_save_seconds = 0.0
+        self.created = time.monotonic()
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.thread = threading.Thread(target=self.__worker, name='camera%s-save' % camera_id, daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, frames=None):
+        """Queue a file save (with the number of frames in it if known), returns False if the queue is full"""
+        with self.lock:
+            try:
+                self.queue.put_nowait((filename, frames))
+            except queue.Full:
+                logger.error('FileSaveQueue: Camera %s save queue full, %s not saved', self.camera_id, filename)
+                return False
+            self.idle.clear()
+        SAVE_BACKLOG.set(self.backlog(), **self.labels)
+        logger.debug('FileSaveQueue: Camera %s queued %s backlog = %s', self.camera_id, filename, self.backlog())
+        return True
+
+    def backlog(self):
+        """Returns the number of saves queued or in progress"""
+        return self.queue.qsize() + (1 if self.active is not None else 0)
+
+    def busy(self):
+        """Returns True while a save is queued or in progress"""
+        return not self.idle.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for all queued saves to finish, returns False if the timeout expired first"""
+        return self.idle.wait(timeout)
+
+    def metrics(self):
+        """Returns the save throughput and backlog"""
+        with self.lock:
+            elapsed_minutes = (time.monotonic() - self.created) / 60
+            return {'camera': self.camera_id,
+                    'backlog': self.backlog(),
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'saves_per_minute': self.completed / elapsed_minutes if elapsed_minutes > 0 else 0.0,
+                    'mean_save_seconds': self.save_seconds / self.completed if self.completed else None,
+                    'frames_per_second': self.frames_saved / self.frame_save_seconds if self.frames_saved else None}
+
+    def __worker(self):
+        """Start each queued save and wait for the camera to finish it, an error fails that save and the worker
+        carries on with the next one"""
+        while True:
+            filename, frames = self.queue.get()
+            self.active = filename
+            start = time.monotonic()
+            try:
+                saved = self.start_save(self.camera_id, filename) and self.__wait_for_save(start)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('FileSaveQueue: Camera %s save of %s raised an error', self.camera_id, filename)
+                saved = False
+            if self.on_complete is not None:
+                try:
+                    self.on_complete(self.camera_id, filename, saved)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('FileSaveQueue: Camera %s save callback for %s failed', self.camera_id, filename)
+            with self.lock:
+                self.active = None
+                if saved:
+                    self.completed += 1
+                    self.save_seconds += time.monotonic() - start
+                    SAVE_SECONDS.observe(time.monotonic() - start, **self.labels)
+                    if frames:
+                        self.frames_saved += frames
+                        self.frame_save_seconds += time.monotonic() - start
+                else:
+                    self.failed += 1
+                    SAVE_FAILURES.inc(**self.labels)
+                if self.queue.empty():
+                    self.idle.set()
+            SAVE_BACKLOG.set(self.backlog(), **self.labels)
+            logger.info('FileSaveQueue: Camera %s save %s %s in %.1f s', self.camera_id, filename,
+                        'completed' if saved else 'failed', time.monotonic() - start)
+
+    def __wait_for_save(self, start):
+        """Poll the camera state until it is no longer saving, returns False on timeout"""
+        time.sleep(self.settings['camera_save_poll_interval'])
+        while time.monotonic() - start < self.settings['camera_save_timeout']:
+            try:
+                response = self.session.get(self.settings['camera_status_path'])
+                if response.status_code == 200 and not save_in_progress(response.json()):
+                    return True
+            except (requests.RequestException, ValueError):
+                logger.debug('FileSaveQueue: Camera %s state poll failed', self.camera_id)
+            time.sleep(self.settings['camera_save_poll_interval'])
+        logger.error('FileSaveQueue: Camera %s save timed out after %s seconds', self.camera_id,
+                     self.settings['camera_save_timeout'])
+        return False
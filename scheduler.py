@@ -0,0 +1,180 @@
+"""
+Scheduler Module
+
+A drift-free scheduler driven by time.monotonic() deadlines.
+
+A single long-lived thread holds a heap of deadlines and sleeps until the next one is due. Repeating
+jobs are re-armed from their intended deadline rather than from the time they actually ran, so
+latency in the callbacks never accumulates into the cadence. Callbacks are handed to a worker thread
+for each job so slow work (such as the HTTP calls of a camera switch) never holds up the ticking thread.
+If a repeating job is still running at its next deadline, or the deadlines have passed, the missed runs
+are skipped and counted and the job is re-armed on the next deadline still to come, so a slow run never
+causes a burst of runs back to back.
+The intended and actual time of every run are kept so the timing of a long run can be checked.
+
+Usage:
+    from scheduler import MonotonicScheduler
+
+    scheduler = MonotonicScheduler()
+    job = scheduler.call_every(10, switch_camera, name='camera-switch')
+    ...
+    job.cancel()
+    print(job.timing_summary())
+    deadline, missed = next_deadline(deadline, 10, time.monotonic())     the re-arm rule on its own
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logmanager import logger
+
+
+def next_deadline(deadline, interval, now):
+    """Returns the deadline after one that has just run and the number of deadlines skipped because they have
+    already passed, so a late run is followed by the next deadline still to come rather than a burst of runs"""
+    deadline += interval
+    if interval <= 0 or deadline > now:
+        return deadline, 0
+    missed = int((now - deadline) // interval) + 1
+    return deadline + missed * interval, missed
+
+
+class ScheduledJob:
+    """
+    ScheduledJob
+
+    A callback registered with the MonotonicScheduler. One-shot jobs have an interval of None,
+    repeating jobs have an interval in seconds (or a function returning one, read every time the
+    job is re-armed so the cadence can change while running).
+
+    Methods:
+        cancel: Stop the job from running again
+        timing_summary: Returns the count, mean and maximum lateness of the runs so far
+    """
+    def __init__(self, name, callback, deadline, interval, executor):
+        self.name = name
+        self.callback = callback
+        self.deadline = deadline
+        self.interval = interval
+        self.executor = executor
+        self.cancelled = False
+        self.runs = 0
+        self.skipped = 0
+        self.future = None
+        self.timing = deque(maxlen=10000)
+
+    def next_interval(self):
+        """Returns the interval to the next run or None for a one-shot job"""
+        if callable(self.interval):
+            return self.interval()
+        return self.interval
+
+    def run(self, intended):
+        """Run the callback and record its intended and actual start times"""
+        actual = time.monotonic()
+        self.timing.append((intended, actual))
+        self.runs += 1
+        try:
+            self.callback()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Scheduler: job %s raised an exception', self.name)
+
+    def cancel(self):
+        """Stop the job from running again"""
+        self.cancelled = True
+
+    def timing_summary(self):
+        """Returns the count, mean and maximum lateness (seconds) of the runs so far and the runs skipped"""
+        lateness = [actual - intended for intended, actual in self.timing]
+        if not lateness:
+            return {'runs': 0, 'mean_lateness': None, 'max_lateness': None, 'skipped': self.skipped}
+        return {'runs': len(lateness), 'mean_lateness': sum(lateness) / len(lateness), 'max_lateness': max(lateness),
+                'skipped': self.skipped}
+
+
+class MonotonicScheduler:
+    """
+    MonotonicScheduler
+
+    A single thread running a heap of monotonic deadlines. The thread is started on first use.
+
+    Methods:
+        call_at: Run a callback once at a time.monotonic() deadline
+        call_later: Run a callback once after a delay in seconds
+        call_every: Run a callback repeatedly at a fixed interval
+        stop: Stop the scheduler thread and cancel all jobs
+    """
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def call_at(self, deadline, callback, name=None, executor=None):
+        """Run a callback once at a time.monotonic() deadline"""
+        return self.__add(ScheduledJob(name or callback.__name__, callback, deadline, None, executor))
+
+    def call_later(self, delay, callback, name=None, executor=None):
+        """Run a callback once after a delay in seconds"""
+        return self.call_at(time.monotonic() + delay, callback, name, executor)
+
+    def call_every(self, interval, callback, name=None, start=None, executor=None):
+        """Run a callback every interval seconds, first at the start deadline (default now + interval)"""
+        job = ScheduledJob(name or callback.__name__, callback, None, interval, executor)
+        job.deadline = start if start is not None else time.monotonic() + job.next_interval()
+        return self.__add(job)
+
+    def stop(self):
+        """Stop the scheduler thread and cancel all jobs"""
+        with self.condition:
+            self.running = False
+            for _, _, job in self.queue:
+                job.cancel()
+            self.queue.clear()
+            self.condition.notify()
+
+    def __add(self, job):
+        """Put a job on the heap and wake the scheduler thread"""
+        if job.executor is None:
+            job.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='%s-%s' % (self.name, job.name))
+        with self.condition:
+            heapq.heappush(self.queue, (job.deadline, next(self.counter), job))
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return job
+
+    def __run(self):
+        """Sleep until the next deadline, hand the job to its worker and re-arm repeating jobs"""
+        with self.condition:
+            while self.running:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                deadline, _, job = self.queue[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.queue)
+                if job.cancelled:
+                    continue
+                interval = job.next_interval()
+                if interval is not None and job.future is not None and not job.future.done():
+                    job.skipped += 1
+                    logger.warning('Scheduler: job %s skipped, the previous run is still going', job.name)
+                else:
+                    job.future = job.executor.submit(job.run, deadline)
+                if interval is not None:
+                    job.deadline, missed = next_deadline(deadline, interval, time.monotonic())
+                    if missed:
+                        job.skipped += missed
+                        logger.warning('Scheduler: job %s skipped %s missed deadlines', job.name, missed)
+                    heapq.heappush(self.queue, (job.deadline, next(self.counter), job))
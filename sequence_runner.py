@@ -0,0 +1,184 @@
+"""
+Sequence Runner Module
+
+Runs an experiment sequence described in a JSON (or YAML) schedule file against the CameraClass.
+
+Each step is given a planned time from the start of the run and is executed on an absolute
+time.monotonic() deadline, so the time taken by the camera and drum API calls does not push the
+following steps later. The planned and actual time of every step is written to a CSV timing log.
+A dry run executes the schedule without calling the cameras or drum and can compress time so a long
+sequence can be checked in a few seconds.
+
+Schedule format:
+    {"name": "speed sweep",
+     "steps": [{"action": "start_recording"},
+               {"action": "hold", "seconds": 2},
+               {"action": "set_rpm", "rpm": 95},
+               {"action": "hold", "seconds": 30},
+               {"action": "log_rpm"},
+               {"action": "ramp", "to": 71.5, "seconds": 60, "step_seconds": 5},
+               {"action": "stop_recording"}]}
+
+Actions:
+    - start_recording / stop_recording: start or stop the camera cadence recording
+    - set_rpm: set the drum speed to "rpm"
+    - hold: wait "seconds" before the next step
+    - ramp: change the drum speed linearly to "to" over "seconds", in increments every "step_seconds"
+    - log_rpm: read and log the measured drum speed
+
+Usage:
+    python sequence_runner.py example_sequence.json
+    python sequence_runner.py example_sequence.json --dry-run --time-scale 60
+"""
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from app_control import settings
+from logmanager import logger, console
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+ACTIONS = ('start_recording', 'stop_recording', 'set_rpm', 'hold', 'ramp', 'log_rpm')
+
+
+def load_schedule(filepath):
+    """Read a schedule from a JSON or YAML file and check its steps"""
+    with open(filepath, encoding='UTF-8') as schedule_file:
+        if filepath.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError('PyYAML is needed to read YAML schedules: pip install pyyaml')
+            schedule = yaml.safe_load(schedule_file)
+        else:
+            schedule = json.load(schedule_file)
+    for number, step in enumerate(schedule['steps']):
+        if step.get('action') not in ACTIONS:
+            raise ValueError('Step %s has an unknown action %s' % (number, step.get('action')))
+    return schedule
+
+
+def plan_schedule(schedule):
+    """Expand the schedule into a list of timed actions (seconds from the start of the run)"""
+    planned = []
+    offset = 0.0
+    rpm = 0.0
+    for number, step in enumerate(schedule['steps']):
+        action = step['action']
+        if action == 'hold':
+            offset += float(step['seconds'])
+        elif action == 'ramp':
+            start_rpm = float(step.get('from', rpm))
+            seconds = float(step['seconds'])
+            increments = max(1, int(round(seconds / float(step.get('step_seconds', 1)))))
+            for increment in range(1, increments + 1):
+                value = round(start_rpm + (float(step['to']) - start_rpm) * increment / increments, 2)
+                planned.append({'step': number, 'action': 'set_rpm', 'value': value,
+                                'planned': offset + seconds * (increment - 1) / increments})
+            offset += seconds
+            rpm = float(step['to'])
+        else:
+            if action == 'set_rpm':
+                rpm = float(step['rpm'])
+            planned.append({'step': number, 'action': action, 'value': step.get('rpm'), 'planned': offset})
+    return planned, offset
+
+
+class SequenceRunner:
+    """
+    SequenceRunner
+
+    Executes a schedule against a CameraClass object on absolute monotonic deadlines.
+
+    Methods:
+        run: Run the schedule and write the timing log, returns the timing records
+        abort: Stop the run before the next step
+    """
+    def __init__(self, camera, schedule, dry_run=False, time_scale=1.0):
+        self.camera = camera
+        self.schedule = schedule
+        self.dry_run = dry_run
+        self.time_scale = float(time_scale)
+        self.planned, self.duration = plan_schedule(schedule)
+        self.timing = []
+        self.aborted = threading.Event()
+
+    def abort(self):
+        """Stop the run before the next step"""
+        self.aborted.set()
+
+    def run(self, logfile=None, start=None):
+        """Run the schedule from the start time (a time.monotonic() value, default now) and write the timing log,
+        returns the timing records. Runners given the same start time run their steps and camera switches together."""
+        logger.info('SequenceRunner: Starting %s, %s actions over %.1f s%s', self.schedule.get('name', 'sequence'),
+                     len(self.planned), self.duration, ' (dry run)' if self.dry_run else '')
+        start = start if start is not None else time.monotonic()
+        for item in self.planned:
+            deadline = start + item['planned'] / self.time_scale
+            if self.aborted.wait(max(0.0, deadline - time.monotonic())):
+                logger.warning('SequenceRunner: Sequence aborted at step %s', item['step'])
+                break
+            actual = time.monotonic()
+            result = self.__execute(item['action'], item['value'], deadline)
+            self.timing.append({'step': item['step'], 'action': item['action'], 'value': item['value'],
+                                'planned': item['planned'], 'actual': (actual - start) * self.time_scale,
+                                'error_ms': (actual - deadline) * 1000, 'result': result})
+        else:
+            self.aborted.wait(max(0.0, start + self.duration / self.time_scale - time.monotonic()))
+        self.__write_timing(logfile)
+        return self.timing
+
+    def __execute(self, action, value, deadline):
+        """Run one action against the camera object, recording is started with its switches anchored to the deadline"""
+        console('SequenceRunner: %s %s' % (action, '' if value is None else value))
+        if self.dry_run:
+            return None
+        if action == 'start_recording':
+            return self.camera.start_camera_recording(deadline)
+        if action == 'stop_recording':
+            return self.camera.stop_camera_recording()
+        if action == 'set_rpm':
+            return self.camera.set_drum_rpm(value)
+        if action == 'log_rpm':
+            rpm = self.camera.get_drum_rpm()
+            console('drum is at %s rpm' % rpm)
+            logger.info('SequenceRunner: drum is at %s rpm', rpm)
+            return rpm
+        return None
+
+    def __write_timing(self, logfile):
+        """Write the planned and actual times of each step to a csv file"""
+        if logfile is None:
+            logfile = os.path.join(settings['sequence_log_dir'],
+                                   datetime.now().strftime('sequence_%Y-%m-%d_%H-%M-%S.csv'))
+        log_dir = os.path.dirname(logfile)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        with open(logfile, 'w', newline='', encoding='UTF-8') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=['step', 'action', 'value', 'planned', 'actual',
+                                                         'error_ms', 'result'])
+            writer.writeheader()
+            writer.writerows(self.timing)
+        logger.info('SequenceRunner: Timing log written to %s', logfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a UCL-Tombola experiment sequence')
+    parser.add_argument('schedule', help='JSON or YAML schedule file')
+    parser.add_argument('--dry-run', action='store_true', help='run without calling the cameras or drum')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='compress time by this factor')
+    parser.add_argument('--log', default=None, help='timing log csv file')
+    args = parser.parse_args()
+    if args.dry_run:
+        CAMERA = None
+    else:
+        from camera_timed import CameraClass
+        CAMERA = CameraClass()
+    SequenceRunner(CAMERA, load_schedule(args.schedule), args.dry_run, args.time_scale).run(args.log)
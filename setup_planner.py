@@ -0,0 +1,95 @@
+"""
+Setup Planner Module
+
+Plans the Chronos recording settings from the frame rate, resolution, cadence and storage save rate.
+
+Each camera records one cadence window (plus a margin for the switch overlap) into its RAM and must
+then save it to camera_storage before its next turn comes round, which with N cameras is (N - 1)
+cadences later (one cadence with a single camera). The planner works out recMaxFrames so the window
+fits in the camera RAM and reports the longest cadence the RAM allows. Whether the saves keep up does
+not depend on the cadence, as a longer window also gives longer to save it, so the save check is
+reported as the highest frame rate the saves keep up with and the fewest cameras needed at this one.
+
+Settings used:
+    - camera_frame_rate: frames per second
+    - camera_resolution: [width, height] in pixels
+    - camera_bits_per_pixel: bits stored per pixel in the camera RAM
+    - camera_ram_bytes: bytes of camera RAM available for recording
+    - camera_save_rate: frames per second camera_storage can save, used until a save has been measured
+    - camera_window_margin: fraction added to the cadence window to cover the switch overlap
+
+Usage:
+    from setup_planner import plan_recording
+
+    plan = plan_recording(frame_rate=250, cadence=10, camera_count=2, save_rate=120)
+    for warning in plan_warnings(plan, cadence=10):
+        print(warning)
+    plan, data_message = recording_setup(camera_count=2)     the plan and the message sent to each camera
+"""
+
+import math
+from app_control import settings
+
+
+def frame_bytes(config=None):
+    """Returns the bytes of camera RAM used by one frame"""
+    config = config if config is not None else settings
+    width, height = config['camera_resolution']
+    return width * height * config['camera_bits_per_pixel'] / 8
+
+
+def plan_recording(frame_rate, cadence, camera_count, save_rate=None, config=None):
+    """Plan recMaxFrames for a cadence window and check it fits in RAM and saves before the camera's next turn"""
+    config = config if config is not None else settings
+    save_rate = save_rate if save_rate else config['camera_save_rate']
+    ram_frames = int(config['camera_ram_bytes'] // frame_bytes(config))
+    window_frames = int(math.ceil(frame_rate * cadence * (1 + config['camera_window_margin'])))
+    max_frames = min(window_frames, ram_frames)
+    save_seconds = max_frames / save_rate
+    turns = camera_count - 1 if camera_count > 1 else 1
+    turn_seconds = turns * cadence
+    margin = 1 + config['camera_window_margin']
+    return {'frame_period': int(round(1000000000 / frame_rate)),
+            'recMaxFrames': max_frames,
+            'window_frames': window_frames,
+            'ram_frames': ram_frames,
+            'save_seconds': save_seconds,
+            'turn_seconds': turn_seconds,
+            'fits_ram': window_frames <= ram_frames,
+            'saves_in_time': save_seconds <= turn_seconds,
+            'save_rate': save_rate,
+            'max_cadence': ram_frames / (frame_rate * margin),
+            'max_frame_rate': save_rate * turns / margin,
+            'min_cameras': int(math.ceil(frame_rate * margin / save_rate)) + 1}
+
+
+def plan_warnings(plan, cadence):
+    """Returns a message for each check of a recording plan that failed"""
+    warnings = []
+    if not plan['fits_ram']:
+        warnings.append('Cadence %s s is too long for the camera RAM (%s frames of %s), the longest that fits is '
+                        '%.1f s' % (cadence, plan['window_frames'], plan['ram_frames'], plan['max_cadence']))
+    if not plan['saves_in_time']:
+        warnings.append('Saves at %.0f frames per second take %.1f s of the %.1f s before the next turn, reduce the '
+                        'frame rate to %d fps or use %s cameras' % (plan['save_rate'], plan['save_seconds'],
+                                                                    plan['turn_seconds'], int(plan['max_frame_rate']),
+                                                                    plan['min_cameras']))
+    return warnings
+
+
+def recording_setup(camera_count, save_rate=None, config=None):
+    """Plan the recording for the cadence and frame rate in the settings, returns the plan (with the recMaxFrames
+    used) and the setup message sent to each camera. A camera_maxframes setting above 0 overrides the plan"""
+    config = config if config is not None else settings
+    plan = plan_recording(config['camera_frame_rate'], float(config['recording_cadence']), camera_count, save_rate,
+                          config)
+    max_frames = config['camera_maxframes'] if config['camera_maxframes'] else plan['recMaxFrames']
+    data_message = {'recMode': config['camera_recMode'], 'framePeriod': plan['frame_period'],
+                    'recMaxFrames': max_frames}
+    return dict(plan, recMaxFrames=max_frames), data_message
+
+
+def unapplied_settings(data_message, applied):
+    """Returns the names of the settings in a setup message that a camera did not apply"""
+    applied = applied if isinstance(applied, dict) else {}
+    return [key for key, value in data_message.items() if applied.get(key) != value]
@@ -0,0 +1,244 @@
+"""
+Simulator Module
+
+Localhost stand-ins for the Chronos 2.1 cameras and the UCL Tombola drum controller, so the CameraClass
+can be exercised and benchmarked without the rig.
+
+The camera simulator implements the /p, /p/state, /startRecording, /stopRecording, /flushRecording and
+/startFilesave endpoints under /control and keeps a simple idle/recording/saving state. The drum simulator
+accepts the setrpm and rpm requests on /api and moves the measured speed towards the set speed. Each
+simulator adds a configurable latency and jitter to every response and can fail a fraction of requests
+with an HTTP 500 or by not answering within the client timeout.
+
+Usage:
+    from simulator import CameraSimulator, DrumSimulator
+
+    camera = CameraSimulator(latency=0.005, jitter=0.002, save_duration=2.0).start()
+    drum = DrumSimulator().start()
+    print(camera.url, drum.url)
+    ...
+    camera.stop()
+    drum.stop()
+
+    python simulator.py     runs two cameras and a drum until stopped with Ctrl-C
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """Pass each request to the simulator that owns the server"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request"""
+        self.server.simulator.handle(self, 'GET', None)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handle a POST request"""
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        self.server.simulator.handle(self, 'POST', payload)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the simulator quiet"""
+
+
+class Simulator:
+    """
+    Simulator
+
+    Base class for a device simulator running a threaded HTTP server on localhost.
+
+    Methods:
+        start: Start the server, returns the simulator
+        stop: Stop the server
+    """
+    base_path = ''
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, timeout_rate=0.0, hang_time=5.0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.hang_time = hang_time
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), SimulatorHandler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self.thread = None
+
+    @property
+    def url(self):
+        """The base url to use in the settings for this device"""
+        return 'http://127.0.0.1:%s%s' % (self.server.server_address[1], self.base_path)
+
+    def start(self):
+        """Start the server, returns the simulator"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method, payload):
+        """Apply the latency and failure model then answer the request"""
+        with self.lock:
+            self.requests += 1
+        delay = max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        if random.random() < self.timeout_rate:
+            delay += self.hang_time
+        if delay:
+            time.sleep(delay)
+        path = handler.path
+        if not path.startswith(self.base_path):
+            self.reply(handler, 404, {'error': 'unknown path %s' % path})
+            return
+        if random.random() < self.failure_rate:
+            self.reply(handler, 500, {'error': 'simulated failure'})
+            return
+        status, body = self.respond(method, path[len(self.base_path):], payload)
+        self.reply(handler, status, body)
+
+    def respond(self, method, path, payload):
+        """Returns the status code and json body for a request, implemented by each device"""
+        raise NotImplementedError
+
+    @staticmethod
+    def reply(handler, status, body):
+        """Send a json response"""
+        data = json.dumps(body).encode('UTF-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class CameraSimulator(Simulator):
+    """
+    CameraSimulator
+
+    A Chronos camera with an idle, recording or saving state. A file save takes save_duration seconds
+    during which the camera cannot record.
+    """
+    base_path = '/control'
+
+    def __init__(self, save_duration=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.save_duration = save_duration
+        self.state = 'idle'
+        self.save_finished = 0.0
+        self.parameters = {'recMode': 'normal', 'framePeriod': 1000000, 'recMaxFrames': 0}
+        self.saved_files = []
+        self.events = []
+
+    def current_state(self):
+        """Returns the camera state, ending a save once its duration has passed"""
+        if self.state == 'saving' and time.monotonic() >= self.save_finished:
+            self.state = 'idle'
+        return self.state
+
+    def respond(self, method, path, payload):
+        """Answer a camera API request"""
+        with self.lock:
+            state = self.current_state()
+            self.events.append((time.monotonic(), path))
+            if path == '/p' and method == 'POST':
+                self.parameters.update(payload)
+                return 200, payload
+            if path == '/p':
+                return 200, dict(self.parameters, state=state)
+            if path.startswith('/p/'):
+                name = path[3:]
+                if name == 'state':
+                    return 200, {'state': state}
+                return 200, {name: self.parameters.get(name)}
+            if path == '/startRecording':
+                if state == 'saving':
+                    return 409, {'error': 'camera is saving'}
+                self.state = 'recording'
+                return 200, {'state': self.state}
+            if path == '/stopRecording':
+                if state == 'recording':
+                    self.state = 'idle'
+                return 200, {'state': self.state}
+            if path == '/flushRecording':
+                return 200, {'state': state}
+            if path == '/startFilesave' and method == 'POST':
+                if state != 'idle':
+                    return 409, {'error': 'camera is %s' % state}
+                self.state = 'saving'
+                self.save_finished = time.monotonic() + self.save_duration
+                self.saved_files.append(payload.get('filename'))
+                return 200, {'state': self.state}
+            return 404, {'error': 'unknown path %s' % path}
+
+
+class DrumSimulator(Simulator):
+    """
+    DrumSimulator
+
+    A drum controller whose measured speed approaches the set speed with a time constant in seconds.
+    """
+    base_path = '/api'
+
+    def __init__(self, time_constant=2.0, noise=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.time_constant = time_constant
+        self.noise = noise
+        self.setpoint = 0.0
+        self.rpm = 0.0
+        self.updated = time.monotonic()
+
+    def current_rpm(self):
+        """Move the speed towards the set speed and return it with a little measurement noise"""
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.time_constant > 0:
+            self.rpm += (self.setpoint - self.rpm) * min(1.0, elapsed / self.time_constant)
+        else:
+            self.rpm = self.setpoint
+        return round(self.rpm + random.gauss(0, self.noise), 3) if self.noise else round(self.rpm, 3)
+
+    def respond(self, method, path, payload):
+        """Answer a drum controller API request"""
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        with self.lock:
+            rpm = self.current_rpm()
+            if 'setrpm' in payload:
+                self.setpoint = float(payload['setrpm'])
+                return 200, {'setrpm': self.setpoint}
+            if payload.get('rpm'):
+                return 200, {'rpm': rpm}
+            return 400, {'error': 'unknown request'}
+
+
+if __name__ == "__main__":
+    CAMERA1 = CameraSimulator(latency=0.005, jitter=0.002, save_duration=2.0, port=8081).start()
+    CAMERA2 = CameraSimulator(latency=0.005, jitter=0.002, save_duration=2.0, port=8082).start()
+    DRUM = DrumSimulator(latency=0.002, port=8080).start()
+    print('camera_controller1 = %s' % CAMERA1.url)
+    print('camera_controller2 = %s' % CAMERA2.url)
+    print('drum_controller    = %s' % DRUM.url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for SIMULATOR in (CAMERA1, CAMERA2, DRUM):
+            SIMULATOR.stop()
@@ -0,0 +1,60 @@
+"""
+Test fixtures
+
+The tests run against the localhost simulators, so no cameras or drum controller are needed. The application
+settings and log file are pointed at a temporary directory before anything is imported that could log, and
+each test gets its own SettingsStore with the metrics endpoint turned off.
+
+Usage:
+    python -m pytest -q
+"""
+
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_control  # noqa: E402  pylint: disable=wrong-import-position
+import logmanager  # noqa: E402  pylint: disable=wrong-import-position
+from simulator import CameraSimulator, DrumSimulator  # noqa: E402  pylint: disable=wrong-import-position
+
+TEST_DIR = tempfile.mkdtemp(prefix='tombola-tests-')
+app_control.configure(os.path.join(TEST_DIR, 'settings.json'))
+logmanager.configure(logfilepath=os.path.join(TEST_DIR, 'tombola-app.log'))
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Returns a SettingsStore using the defaults with fast polling, no metrics endpoint and files in tmp_path"""
+    values = dict(app_control.initialise(),
+                  metrics_port=0,
+                  console_via_log_queue=False,
+                  health_check_interval=3600,
+                  camera_save_poll_interval=0.02,
+                  camera_save_timeout=5,
+                  camera_controller_timeout=0.5,
+                  recording_cadence=3600,
+                  recording_index_path=str(tmp_path / 'recording_index.db'),
+                  rpm_log_dir=str(tmp_path / 'rpm'),
+                  sequence_log_dir=str(tmp_path / 'sequence'),
+                  sensor_log_dir=str(tmp_path / 'sensor'))
+    return app_control.SettingsStore(values=values, path=str(tmp_path / 'settings.json'))
+
+
+@pytest.fixture
+def cameras():
+    """Returns two running camera simulators that are stopped after the test"""
+    simulators = [CameraSimulator(save_duration=0.05).start() for _ in range(2)]
+    yield simulators
+    for simulator in simulators:
+        simulator.stop()
+
+
+@pytest.fixture
+def drum():
+    """Returns a running drum simulator that is stopped after the test"""
+    simulator = DrumSimulator(time_constant=0.0, noise=0.0).start()
+    yield simulator
+    simulator.stop()
@@ -0,0 +1,75 @@
+"""Tests of camera switching against the simulators when the outgoing camera fails to stop"""
+
+import time
+import pytest
+from camera_timed import SWITCH_COUNT, CameraClass
+
+
+def switch_count(outcome):
+    """Returns the total of the switch counter for an outcome over all labels"""
+    return sum(value for labels, value in SWITCH_COUNT.values.items() if ('outcome', outcome) in labels)
+
+
+@pytest.fixture(name='camera')
+def camera_class(config, cameras, drum):
+    """Returns a CameraClass recording from the camera simulators, with the cadence too long to switch by itself"""
+    config.update({'camera_controllers': [simulator.url for simulator in cameras], 'drum_controller': drum.url},
+                  persist=False)
+    camera = CameraClass(config=config)
+    yield camera
+    camera.running = False
+    camera.scheduler.stop()
+
+
+def test_switch_hands_over_and_saves(camera, cameras):
+    """A switch starts the next camera, stops the last one and saves both segments"""
+    camera.start_camera_recording()
+    assert camera.camera_no == 1
+    camera.switch_camera()
+    camera.handoffs[1].result(timeout=5)
+    assert camera.camera_no == 2
+    assert cameras[0].state != 'recording'
+    assert camera.switch_history[-1]['overlap'] is not None
+    camera.stop_camera_recording()
+    statuses = {segment['camera']: segment['save_status'] for segment in camera.find_segments()}
+    assert statuses == {1: 'completed', 2: 'completed'}
+
+
+@pytest.mark.parametrize('failure', ['unreachable', 'error'])
+def test_retire_failure_does_not_break_the_switch(camera, cameras, failure):
+    """An outgoing camera that fails to stop still has its segment indexed and the switch completes"""
+    camera.start_camera_recording()
+    assert camera.camera_no == 1
+    if failure == 'unreachable':
+        camera.cameras[1].session.base_url = 'http://127.0.0.1:9/control'
+    else:
+        cameras[0].failure_rate = 1.0
+    stop_failed = switch_count('stop_failed')
+    camera.switch_camera()
+    camera.handoffs[1].result(timeout=5)
+    assert camera.camera_no == 2
+    assert cameras[1].state == 'recording'
+    assert camera.switch_history[-1]['outgoing'] == 1
+    assert camera.switch_history[-1]['stop_ack'] is not None
+    assert switch_count('stop_failed') == stop_failed + 1
+    assert camera.wait_for_saves(5)
+    segments = camera.find_segments()
+    assert [segment['camera'] for segment in segments] == [1]
+    assert segments[0]['save_status'] in ('failed', 'not_saved')
+    camera.stop_camera_recording()
+    assert cameras[1].state != 'recording'
+
+
+def test_stop_waits_for_a_slow_switch(camera, cameras):
+    """Stopping while a switch is running waits for it and stops the camera it started"""
+    camera.start_camera_recording()
+    cameras[1].latency = 0.2
+    camera.switch_job.cancel()
+    camera.switch_job = camera.scheduler.call_later(0, camera.switch_camera, name='slow-switch',
+                                                    executor=camera.switch_job.executor)
+    time.sleep(0.05)
+    camera.stop_camera_recording()
+    assert camera.camera_no == 2
+    assert cameras[0].state != 'recording'
+    assert cameras[1].state != 'recording'
+    assert sorted(segment['camera'] for segment in camera.find_segments()) == [1, 2]
@@ -0,0 +1,31 @@
+"""Tests of the metrics with label values of mixed types"""
+
+from metrics import Registry, label_key
+
+
+def test_label_key_sorts_names_and_stringifies_values():
+    """Label keys are sorted by name with the values kept as text"""
+    assert label_key({'status': 500, 'endpoint': 'camera1'}) == (('endpoint', 'camera1'), ('status', '500'))
+
+
+def test_mixed_label_values_expose_and_summarise():
+    """Integer and text values of one label sort together in the exposition and summary"""
+    registry = Registry()
+    counter = registry.counter('test_errors_total', 'Errors')
+    counter.inc(endpoint='camera1', status=500)
+    counter.inc(endpoint='camera1', status='connection')
+    counter.inc(endpoint='camera1', status=500)
+    gauge = registry.gauge('test_backlog', 'Backlog')
+    gauge.set(2, camera=1)
+    gauge.set(3, camera='drum')
+    histogram = registry.histogram('test_request_seconds', 'Latency')
+    histogram.observe(0.003, endpoint='camera1', status=200)
+    histogram.observe(0.2, endpoint='camera1', status='timeout')
+    text = registry.exposition()
+    assert 'test_errors_total{endpoint="camera1",status="500"} 2' in text
+    assert 'test_errors_total{endpoint="camera1",status="connection"} 1' in text
+    assert 'test_backlog{camera="1"} 2' in text
+    assert 'test_request_seconds_count{endpoint="camera1",status="timeout"} 1' in text
+    summary = registry.summary()
+    assert 'status="connection"' in summary
+    assert histogram.quantile(0.5, endpoint='camera1', status=200) == 0.003
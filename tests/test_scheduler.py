@@ -0,0 +1,61 @@
+"""Tests of the scheduler re-arm rule and of skipping runs that fall behind"""
+
+import time
+from scheduler import MonotonicScheduler, next_deadline
+
+
+def test_next_deadline_on_time():
+    """A run on time is re-armed one interval on"""
+    assert next_deadline(10, 1, 10.2) == (11, 0)
+
+
+def test_next_deadline_skips_missed_deadlines():
+    """A run several intervals late skips the deadlines that have passed"""
+    assert next_deadline(10, 1, 13.5) == (14, 3)
+
+
+def test_next_deadline_on_a_boundary_moves_past_now():
+    """A deadline landing exactly on now counts as missed"""
+    deadline, missed = next_deadline(10, 1, 12.0)
+    assert deadline > 12.0
+    assert missed == 2
+
+
+def test_next_deadline_zero_interval_never_skips():
+    """A zero interval never counts skipped deadlines"""
+    assert next_deadline(10, 0, 20) == (10, 0)
+
+
+def test_slow_job_is_skipped_not_run_back_to_back():
+    """A job slower than its interval skips runs rather than running back to back"""
+    scheduler = MonotonicScheduler('test-scheduler')
+
+    def slow():
+        time.sleep(0.25)
+
+    job = scheduler.call_every(0.1, slow, name='slow')
+    try:
+        time.sleep(1.2)
+    finally:
+        job.cancel()
+        scheduler.stop()
+    starts = [actual for _, actual in job.timing]
+    assert job.skipped > 0
+    assert len(starts) >= 2
+    assert min(later - earlier for earlier, later in zip(starts, starts[1:])) >= 0.2
+    assert job.timing_summary()['skipped'] == job.skipped
+
+
+def test_late_run_rearms_on_a_future_deadline():
+    """A job started long after its deadline runs once and re-arms on the next deadline to come"""
+    scheduler = MonotonicScheduler('test-scheduler')
+    now = time.monotonic()
+    job = scheduler.call_every(1.0, lambda: None, name='late', start=now - 5.5)
+    try:
+        time.sleep(0.1)
+    finally:
+        job.cancel()
+        scheduler.stop()
+    assert job.runs == 1
+    assert job.skipped == 5
+    assert job.deadline > now